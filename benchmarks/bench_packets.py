@@ -0,0 +1,64 @@
+# Measures how many packets per second can be checked and parsed
+# Run from repository folder with: python -m benchmarks.bench_packets
+import time
+
+from frames import encode_frames
+from packets import is_packet_ok, parse_packets
+from replay import synthetic_packets
+from serialport import PacketFramer, frame_batch
+
+
+def make_packets(count, corrupt_rate=0.01, seed=1):
+    return [packet for _, packet in synthetic_packets(10, count, corrupt_rate, seed)]
+
+
+# Old way of parsing, one data unit at a time with float()
+def parse_with_float(packets):
+    rows = []
+    for packet in packets:
+        try:
+            rows.append([float(x) for x in packet.split(",")])
+        except ValueError:
+            pass
+    return rows
+
+
+# Splits a stream of binary frames to batches, in chunks like they come from serial port
+def read_frames(data, chunk=4096):
+    framer = PacketFramer()
+    batches = []
+    for i in range(0, len(data), chunk):
+        _, values = framer.feed(data[i:i + chunk])
+        if values is not None:
+            batches.append(frame_batch(time.time(), values))
+    return batches
+
+
+# Runs function a few times and returns the best time
+def best_time(function, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(count=100000):
+    for corrupt_rate in (0.0, 0.01, 0.1):
+        packets = make_packets(count, corrupt_rate)
+        results = {
+            "is_packet_ok": best_time(lambda: [is_packet_ok(p) for p in packets]),
+            "parse_packets": best_time(parse_packets, packets),
+            "float() per data unit": best_time(parse_with_float, packets),
+        }
+        if corrupt_rate == 0.0:
+            frames = encode_frames(parse_packets(packets).values)
+            results["binary frames"] = best_time(read_frames, frames)
+        print(f"{count} packets, {corrupt_rate:.0%} corrupted")
+        for name, seconds in results.items():
+            print(f"    {name:24} {count / seconds:12,.0f} packets/s")
+
+
+if __name__ == "__main__":
+    main()
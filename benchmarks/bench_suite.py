@@ -0,0 +1,278 @@
+# Measures hot paths of the app and saves results to a json file, so results of
+# different versions can be compared
+# Run from repository folder with:
+#     python -m benchmarks.bench_suite --output bench.json
+#     python -m benchmarks.bench_suite --output new.json --compare bench.json
+# Graphs are drawn with QT_QPA_PLATFORM=offscreen, so no display is needed
+# If Qt or QtWebEngine can't be imported, gui benchmarks are skipped and the
+# reason is saved in results. Time axis only needs pyqtgraph
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy
+
+from benchmarks.bench_packets import best_time, make_packets, read_frames
+from frames import encode_frames
+from logger import TelemetryLogger
+from metrics import METRICS
+from packets import is_packet_ok, parse_batch, parse_packets
+from schema import CHANNELS, DERIVED_CHANNELS
+from storage import TelemetryStore
+
+
+# Numbers of samples in store for gui benchmarks
+GUI_SIZES = [1000, 100000, 1000000]
+# Packets added in every measured gui tick, about one second of data at a high rate
+TICK_PACKETS = 100
+# Samples per second of pretend flight
+RATE = 10.0
+
+
+# Median time of running function repeat times
+def median_time(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_parse(count):
+    results = {}
+    for corrupt_rate in (0.0, 0.01, 0.1):
+        packets = make_packets(count, corrupt_rate)
+        timestamps = numpy.arange(count, dtype=numpy.float64)
+        results[f"{corrupt_rate:.0%} corrupted"] = {
+            "is_packet_ok": count / best_time(lambda: [is_packet_ok(p) for p in packets]),
+            "parse_packets": count / best_time(parse_packets, packets),
+            "parse_batch": count / best_time(parse_batch, timestamps, packets),
+        }
+    frames = encode_frames(parse_packets(make_packets(count, 0.0)).values)
+    results["binary frames"] = count / best_time(read_frames, frames)
+    # Packets per second
+    return results
+
+
+def bench_storage(count):
+    rows = parse_packets(make_packets(10000, 0.0)).values
+    rows = numpy.tile(rows, (count // len(rows) + 1, 1))[:count]
+    timestamps = numpy.arange(count, dtype=numpy.float64)
+    results = {}
+    for batch in (1, 100, 10000):
+        def append():
+            store = TelemetryStore()
+            if batch == 1:
+                for i in range(count):
+                    store.append_row(timestamps[i], rows[i])
+            else:
+                for i in range(0, count, batch):
+                    store.append(timestamps[i:i + batch], rows[i:i + batch])
+        results[f"batch {batch}"] = count / best_time(append, repeat=3)
+    # Rows per second
+    return results
+
+
+def bench_logger(count):
+    packets = make_packets(count, 0.01)
+    received = time.time()
+    results = {}
+    for name, npz in (("csv", False), ("csv+npz", True)):
+        with tempfile.TemporaryDirectory() as folder:
+            logger = TelemetryLogger(os.path.join(folder, "data.csv"),
+                                     npz_folder=os.path.join(folder, "npz") if npz else None)
+            logger.start()
+            start = time.perf_counter()
+            for i, packet in enumerate(packets):
+                logger.log(received + i / RATE, packet)
+            # Closing waits until everything is written and synced to disk
+            logger.close()
+            results[name] = count / (time.perf_counter() - start)
+    # Packets per second
+    return results
+
+
+# Cost of ticks of time axis when graph is opened and when it is moved
+def bench_ticks():
+    import dateaxis
+    axis = dateaxis.DateAxisItem(orientation="bottom")
+    caches = [dateaxis._tick_values, dateaxis._tick_grid, dateaxis._tick_string]
+    now = time.time()
+    results = {}
+    for name, span in (("1 minute", 60), ("1 hour", 3600), ("1 day", 86400), ("1 year", 366 * 86400)):
+        def ticks(shift):
+            x0 = now - span + shift
+            for spacing, values in axis.tickValues(x0, x0 + span, 800):
+                axis.tickStrings(values, 1.0, spacing)
+
+        def cold():
+            for cache in caches:
+                cache.cache_clear()
+            ticks(0.0)
+
+        # Moving graph by a thousandth of range, like dragging it with mouse
+        def pan():
+            for i in range(1000):
+                ticks(span * i / 1000)
+        results[name] = {"cold": median_time(cold, 20), "pan per frame": median_time(pan, 3) / 1000}
+    # Seconds
+    return results
+
+
+# Makes a store of count samples that ends now, like a long flight
+def _fill_window(window, count):
+    values = parse_packets(make_packets(min(count, 10000), 0.0)).values
+    values = numpy.tile(values, (count // len(values) + 1, 1))[:count]
+    timestamps = time.time() - numpy.arange(count, 0, -1) / RATE
+    window.store.clear()
+    window.derived.clear()
+    window.store.append(timestamps, numpy.hstack((values, window.derived.update(timestamps, values))))
+    for channel, pyramid in window.pyramids.items():
+        pyramid.clear()
+        pyramid.update(window.store.column(channel))
+
+
+# Time of one gui tick with new packets, of drawing the frame after it and
+# of painting the window
+def bench_gui(main, app, sizes):
+    window = main.Window()
+    # Ticks are called by hand, so timers of window would only add noise
+    window.qTimer.stop()
+    window.metrics_timer.stop()
+    window.resize(1600, 1000)
+    app.processEvents()
+    packets = make_packets(TICK_PACKETS, 0.01)
+    results = {}
+    for count in sizes:
+        _fill_window(window, count)
+        results[count] = {}
+        for view in ("live", "whole flight"):
+            window.follow_live.setChecked(view == "live")
+            if view == "whole flight":
+                window.show_whole_flight()
+            app.processEvents()
+            METRICS.clear()
+            updates = []
+            frames = []
+            repaints = []
+            for _ in range(5):
+                received = time.time()
+                for i, packet in enumerate(packets):
+                    main.receive_packet(received + i / 1000, packet)
+                start = time.perf_counter()
+                window.update_data_real()
+                updates.append(time.perf_counter() - start)
+                # Frame is drawn now instead of waiting for frame timer
+                window.frame_timer.stop()
+                start = time.perf_counter()
+                window.render_frame()
+                frames.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                window.repaint()
+                app.processEvents()
+                repaints.append(time.perf_counter() - start)
+            timers = METRICS.snapshot()["timers"]
+            results[count][view] = {
+                "update_data_real": statistics.median(updates),
+                "render_frame": statistics.median(frames),
+                "repaint": statistics.median(repaints),
+                # Mean time of every part of update, from metrics.py
+                "parts": {name: timer["mean"] for name, timer in timers.items()
+                          if timer["count"] and name not in ("latency", "gui.frame_interval", "render.frame")},
+            }
+    window.close()
+    # Seconds
+    return results
+
+
+def _gui_modules():
+    try:
+        from PyQt5 import QtWidgets
+        import main
+    except ImportError as e:
+        return None, None, f"{type(e).__name__}: {e}"
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    return main, app, None
+
+
+def _git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return None
+
+
+# Prints results that changed more than 10% from an older results file
+# Throughputs are better when bigger and times are better when smaller
+def compare(new, old, path=""):
+    for key, value in new.items():
+        if key not in old:
+            continue
+        name = f"{path}/{key}" if path else str(key)
+        if isinstance(value, dict) and isinstance(old[key], dict):
+            compare(value, old[key], name)
+        elif isinstance(value, float) and isinstance(old[key], float) and old[key] > 0:
+            ratio = value / old[key]
+            if abs(ratio - 1) > 0.1:
+                print(f"{name:70} {old[key]:12.4g} -> {value:12.4g} ({ratio:.2f}x)")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks of parsing, storage, logging and drawing")
+    arg_parser.add_argument("--output", default="bench.json", metavar="JSON")
+    arg_parser.add_argument("--compare", metavar="JSON", help="print changes from an older results file")
+    arg_parser.add_argument("--packets", type=int, default=100000, help="packets for parse, storage and logger")
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=GUI_SIZES, help="samples for gui benchmarks")
+    args = arg_parser.parse_args()
+
+    results = {
+        "version": _git_version(),
+        "time": time.time(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "channels": len(CHANNELS) + len(DERIVED_CHANNELS),
+    }
+    print("Parsing")
+    results["parse packets/s"] = bench_parse(args.packets)
+    print("Storage")
+    results["storage rows/s"] = bench_storage(args.packets)
+    print("Logger")
+    results["logger packets/s"] = bench_logger(args.packets)
+    try:
+        from PyQt5 import QtWidgets
+        # Axis items need an application, but not a window
+        app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        print("Time axis")
+        results["ticks s"] = bench_ticks()
+    except ImportError as e:
+        print("Skipping time axis benchmarks,", e)
+        results["ticks skipped"] = f"{type(e).__name__}: {e}"
+    main_module, app, error = _gui_modules()
+    if error is None:
+        print("Gui")
+        results["gui s"] = bench_gui(main_module, app, args.sizes)
+    else:
+        print("Skipping gui benchmarks,", error)
+        results["gui skipped"] = error
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    print("Results saved to", args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.loads(json.dumps(results)), json.load(f))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
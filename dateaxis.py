@@ -0,0 +1,172 @@
+# Time axis for graphs, times are shown as local date and time
+# Doesn't need QtWebEngine, so it can be used without the map, like in benchmarks
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import numpy
+import pyqtgraph as pg
+from pyqtgraph import AxisItem
+
+
+# Time axis zoom levels, from the most zoomed out
+# (range bigger than, spacing of ticks in seconds, NumPy datetime unit of ticks, ticks every this many units)
+_TICK_LEVELS = [
+    (63072001, 366 * 86400, "Y", 1),  # 3600s*24*(365+366) = 2 years (count leap year)
+    (5270400, 31 * 86400, "M", 1),  # 3600s*24*61 = 61 days
+    (172800, 86400, "D", 1),  # 3600s24*2 = 2 days
+    (7200, 3600, "h", 1),  # 3600s*2 = 2hours
+    (1200, 600, "m", 10),  # 60s*20 = 20 minutes
+    (120, 60, "m", 1),  # 60s*2 = 2 minutes
+    (20, 10, "s", 10),  # 20s
+]
+
+# Ticks are computed for buckets of this many ticks, so moving graph a little
+# uses the same bucket again
+_TICK_BUCKET = 256
+
+
+# All ticks of one bucket as seconds since 1970
+# offset is difference of local time from UTC in seconds, so ticks are at
+# whole hours, days etc. in local time
+@lru_cache(maxsize=256)
+def _tick_grid(unit, step, bucket, offset):
+    size = _TICK_BUCKET * step
+    start = numpy.datetime64(bucket * size, unit)
+    grid = numpy.arange(start, start + size, step)
+    return grid.astype("datetime64[s]").astype(numpy.float64) - offset
+
+
+# Which bucket has the given time
+def _tick_bucket(value, unit, step, offset):
+    local = numpy.datetime64(int(numpy.floor(value + offset)), "s").astype(f"datetime64[{unit}]")
+    return int(local.astype(numpy.int64)) // (_TICK_BUCKET * step)
+
+
+# Major ticks for time axis, shared by all graphs
+# Graphs have linked x-axis, so all of them ask for the same ticks and only
+# the first one has to compute them
+# Returns (spacing, ticks), or None if range is too small for time ticks
+@lru_cache(maxsize=1024)
+def _tick_values(minVal, maxVal, maxMajSteps):
+    dx = maxVal - minVal
+    for threshold, spacing, unit, step in _TICK_LEVELS:
+        if dx > threshold:
+            break
+    else:
+        if dx > 2:  # 2s
+            majticks = numpy.arange(int(minVal), int(maxVal), dtype=numpy.float64)
+            spacing = 1
+        else:  # <2s , use standard implementation from parent
+            return None
+
+    if dx > 20:
+        offset = time.localtime(minVal).tm_gmtoff
+        first = _tick_bucket(minVal, unit, step, offset)
+        last = _tick_bucket(maxVal, unit, step, offset)
+        grid = numpy.concatenate([_tick_grid(unit, step, bucket, offset) for bucket in range(first, last + 1)])
+        start = numpy.searchsorted(grid, minVal, side="right")
+        stop = numpy.searchsorted(grid, maxVal, side="left")
+        # Year of maxVal doesn't get a tick, even if it has already started
+        if unit == "Y":
+            stop = numpy.searchsorted(grid, maxVal, side="right") - 1
+        majticks = grid[start:stop]
+
+    L = len(majticks)
+    if L > maxMajSteps:
+        majticks = majticks[::int(numpy.ceil(float(L) / maxMajSteps))]
+
+    # Ticks were computed with the UTC offset at minVal, ticks in summer or
+    # winter time are moved by the difference
+    if dx > 20:
+        majticks = numpy.array([t + offset - time.localtime(t).tm_gmtoff for t in majticks])
+
+    return spacing, tuple(majticks.tolist())
+
+
+# Text of one tick, same times are asked for again and again when graphs are moved
+@lru_cache(maxsize=4096)
+def _tick_string(value, fmt):
+    try:
+        return datetime.fromtimestamp(value).strftime(fmt)
+    except ValueError:  # Windows can't handle dates before 1970
+        return ''
+
+
+# This class makes it possible for graphs to display time as x-axis
+class DateAxisItem(AxisItem):
+    # Max width in pixels reserved for each label in axis
+    _pxLabelWidth = 80
+
+    def __init__(self, *args, **kwargs):
+        AxisItem.__init__(self, *args, **kwargs)
+        self._oldAxis = None
+
+    def tickValues(self, minVal, maxVal, size):
+        maxMajSteps = max(int(size/self._pxLabelWidth), 1)
+        ticks = _tick_values(minVal, maxVal, maxMajSteps)
+        if ticks is None:
+            return AxisItem.tickValues(self, minVal, maxVal, size)
+        spacing, majticks = ticks
+        return [(spacing, list(majticks))]
+
+    def tickStrings(self, values, scale, spacing):
+        if not values:
+            return []
+
+        if spacing >= 31622400:  # 366 days
+            fmt = "%Y"
+
+        elif spacing >= 2678400:  # 31 days
+            fmt = "%Y %b"
+
+        elif spacing >= 86400:  # = 1 day
+            fmt = "%b/%d"
+
+        elif spacing >= 3600:  # 1 h
+            fmt = "%b/%d-%Hh"
+
+        elif spacing >= 60:  # 1 m
+            fmt = "%H:%M"
+
+        elif spacing >= 1:  # 1s
+            fmt = "%H:%M:%S"
+
+        else:
+            # less than 2s (show microseconds)
+            # fmt = '%S.%f"'
+            fmt = '[+%fms]'  # explicitly relative to last second
+
+        return [_tick_string(x, fmt) for x in values]
+
+    def attachToPlotItem(self, plotItem):
+        pen_line = pg.mkPen(color=(0, 0, 0), width=3)
+        self.setParentItem(plotItem)
+        viewBox = plotItem.getViewBox()
+        self.linkToView(viewBox)
+        self._oldAxis = plotItem.axes[self.orientation]['item']
+        self._oldAxis.hide()
+        # Old axis is taken out of layout, so this axis can be put in its place
+        plotItem.layout.removeItem(self._oldAxis)
+        plotItem.axes[self.orientation]['item'] = self
+        pos = plotItem.axes[self.orientation]['pos']
+        plotItem.layout.addItem(self, *pos)
+        self.setZValue(-1000)
+        plotItem.getAxis('bottom').setPen(pen_line)
+
+    # Puts back the axis that was replaced by attachToPlotItem
+    # Ticks are cached for all axes together, so nothing is lost by detaching
+    def detachFromPlotItem(self):
+        plotItem = self.parentItem()
+        if plotItem is None or self._oldAxis is None:
+            return
+        pos = plotItem.axes[self.orientation]['pos']
+        plotItem.layout.removeItem(self)
+        self.unlinkFromView()
+        self.setParentItem(None)
+        if self.scene() is not None:
+            self.scene().removeItem(self)
+        plotItem.axes[self.orientation]['item'] = self._oldAxis
+        plotItem.layout.addItem(self._oldAxis, *pos)
+        self._oldAxis.show()
+        self._oldAxis = None
@@ -0,0 +1,162 @@
+# Values that are calculated from received data while it arrives
+# Every batch of samples only updates a few numbers of state, so the cost per
+# sample stays the same however long the flight is. Nothing is calculated again
+# over the whole history
+import numpy
+
+from schema import CHANNELS, DERIVED_CHANNELS
+
+
+# Time constant of smoothing of vertical speed, in seconds
+VSPEED_TAU = 2.0
+# Time constant of rolling mean and standard deviation of gases, in seconds
+GAS_TAU = 30.0
+# Gases that get a rolling mean and standard deviation
+GAS_CHANNELS = ["co2", "tvoc", "no2"]
+# Pressure at sea level, for barometric altitude, Pa
+SEA_LEVEL_PRESSURE = 101325.0
+# Packets that arrive in one read from serial port have the same time, so a
+# smallest time step is used for them in smoothing
+MIN_DT = 0.01
+
+_COLUMN = {name: i for i, name in enumerate(CHANNELS)}
+
+
+# Exponentially weighted moving average of x, where every sample has its own weight
+# y[i] = (1 - weight[i]) * y[i - 1] + weight[i] * x[i], and y[-1] is start
+# Calculated with cumulative sums instead of a loop over samples. The sums are
+# restarted every time weights have made old values smaller than 1e-130, so
+# numbers never get too big or too small for float64
+def ewma(x, weights, start):
+    count = len(x)
+    y = numpy.empty(count)
+    # Weight 1 would make log of (1 - weight) infinite, so it keeps 1e-130 of old value
+    with numpy.errstate(divide="ignore"):
+        decay = numpy.maximum(numpy.log1p(-weights), -299.0)
+    total = numpy.cumsum(decay)
+    first = 0
+    while first < count:
+        base = total[first - 1] if first else 0.0
+        # Block ends where weights have made values before it 1e-130 times smaller
+        last = max(int(numpy.searchsorted(-total, -base + 300.0, side="right")), first + 1)
+        log_scale = total[first:last] - base
+        sums = numpy.cumsum(weights[first:last] * x[first:last] * numpy.exp(-log_scale))
+        y[first:last] = numpy.exp(log_scale) * (start + sums)
+        start = y[last - 1]
+        first = last
+    return y
+
+
+# Weights of samples for smoothing with time constant tau
+# Samples where x is NaN get weight 0, so they don't change the average
+# If there is no average yet (start is NaN), the first sample gets weight 1
+def _weights(t, x, last_t, start, tau):
+    finite = numpy.isfinite(x)
+    # Time since previous sample that had a value
+    times = numpy.where(finite, t, numpy.nan)
+    previous = numpy.concatenate(([last_t], times[:-1]))
+    previous = numpy.fmax.accumulate(previous)
+    dt = numpy.maximum(numpy.nan_to_num(t - previous, nan=MIN_DT), MIN_DT)
+    weights = numpy.where(finite, -numpy.expm1(-dt / tau), 0.0)
+    if numpy.isnan(start):
+        indexes = numpy.flatnonzero(finite)
+        if len(indexes):
+            weights[indexes[0]] = 1.0
+        start = 0.0
+    return weights, numpy.where(finite, x, 0.0), start
+
+
+def _divide(a, b):
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        ratio = a / b
+    ratio[~numpy.isfinite(ratio)] = numpy.nan
+    return ratio
+
+
+class DerivedMetrics:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Time and altitude of the first sample of the latest time that had altitude, for vertical speed
+        self.alt_time = numpy.nan
+        self.alt = numpy.nan
+        self.vspeed = numpy.nan
+        self.vspeed_time = numpy.nan
+        # Rolling mean of value and of value squared for every gas
+        self.means = {gas: numpy.nan for gas in GAS_CHANNELS}
+        self.squares = {gas: numpy.nan for gas in GAS_CHANNELS}
+        self.gas_times = {gas: numpy.nan for gas in GAS_CHANNELS}
+
+    # Calculates derived channels for new samples
+    # values has one row of CHANNELS per sample, returns one row of DERIVED_CHANNELS per sample
+    # Derived channels in schema that aren't calculated here are NaN
+    def update(self, timestamps, values):
+        t = numpy.asarray(timestamps, dtype=numpy.float64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        derived = numpy.full((len(t), len(DERIVED_CHANNELS)), numpy.nan)
+        if len(t) == 0:
+            return derived
+        columns = {"vspeed": self._vertical_speed(t, values[:, _COLUMN["alt"]])}
+        press = values[:, _COLUMN["press"]]
+        with numpy.errstate(invalid="ignore"):
+            columns["baro_alt"] = 44330.77 * (1.0 - (press / SEA_LEVEL_PRESSURE) ** 0.190263)
+        for gas in GAS_CHANNELS:
+            columns[gas + "_mean"], columns[gas + "_std"] = self._rolling(t, values[:, _COLUMN[gas]], gas)
+        columns["pm25_pm100"] = _divide(values[:, _COLUMN["pm25"]], values[:, _COLUMN["pm100"]])
+        columns["pm10_pm25"] = _divide(values[:, _COLUMN["pm10"]], values[:, _COLUMN["pm25"]])
+        for i, name in enumerate(DERIVED_CHANNELS):
+            if name in columns:
+                derived[:, i] = columns[name]
+        return derived
+
+    # Slope between samples that have altitude, smoothed
+    # Packets of one read from serial port have the same time, so every time is
+    # made into one sample first: the first sample that has it. Slope is taken from
+    # the previous time, so packets that come in groups give the same speed as
+    # packets that come one by one, and a group isn't changed by later packets of it
+    def _vertical_speed(self, t, alt):
+        finite = numpy.flatnonzero(numpy.isfinite(alt))
+        slope = numpy.full(len(t), numpy.nan)
+        if len(finite):
+            times = t[finite]
+            first = numpy.flatnonzero(times != numpy.concatenate(([self.alt_time], times[:-1])))
+            if len(first):
+                group_times = times[first]
+                group_alts = alt[finite][first]
+                dt = group_times - numpy.concatenate(([self.alt_time], group_times[:-1]))
+                with numpy.errstate(invalid="ignore", divide="ignore"):
+                    group_slope = (group_alts - numpy.concatenate(([self.alt], group_alts[:-1]))) / dt
+                # Time going back, like when a replay starts again, has no slope
+                group_slope[~(dt > 0) | ~numpy.isfinite(group_slope)] = numpy.nan
+                slope[finite[first]] = group_slope
+                self.alt_time = group_times[-1]
+                self.alt = group_alts[-1]
+        started = not numpy.isnan(self.vspeed)
+        weights, x, start = _weights(t, slope, self.vspeed_time, self.vspeed, VSPEED_TAU)
+        vspeed = ewma(x, weights, start)
+        if weights.any():
+            self.vspeed = vspeed[-1]
+            self.vspeed_time = t[numpy.flatnonzero(weights)[-1]]
+        # Before the first slope there is no vertical speed
+        if not started:
+            vspeed[numpy.cumsum(weights) == 0] = numpy.nan
+        return vspeed
+
+    # Rolling mean and standard deviation
+    # Standard deviation comes from rolling means of value and of value squared
+    def _rolling(self, t, x, gas):
+        started = not numpy.isnan(self.means[gas])
+        weights, x0, start = _weights(t, x, self.gas_times[gas], self.means[gas], GAS_TAU)
+        mean = ewma(x0, weights, start)
+        square = ewma(x0 * x0, weights, 0.0 if numpy.isnan(self.squares[gas]) else self.squares[gas])
+        if weights.any():
+            self.means[gas] = mean[-1]
+            self.squares[gas] = square[-1]
+            self.gas_times[gas] = t[numpy.flatnonzero(weights)[-1]]
+        if not started:
+            empty = numpy.cumsum(weights) == 0
+            mean[empty] = numpy.nan
+            square[empty] = numpy.nan
+        std = numpy.sqrt(numpy.maximum(square - mean * mean, 0.0))
+        return mean, std
@@ -0,0 +1,163 @@
+# Binary frames for sending packets from base station
+# A text packet is over 100 bytes, which limits how many packets per second fit
+# through 9600 baud. A binary frame has the same data units as whole numbers
+# in 47 bytes, and a sequence number and CRC, so lost and corrupted frames are noticed
+#
+# Frame, all numbers are little endian:
+#     sync       2 bytes   0xA5 0xC3, these bytes are never in text packets
+#     length     1 byte    length of data units in bytes, 40 with FIELDS in schema.py
+#     seq        uint16    frame number, goes up by one for every frame and wraps around
+#     data units 40 bytes  in the order of FIELDS, with dtype and scale from FIELDS
+#     crc        uint16    CRC-16/CCITT-FALSE of length, seq and data units
+#
+# Text packets still work, base station can send both
+import numpy
+
+from schema import CHANNELS, FIELDS
+
+
+SYNC = b"\xa5\xc3"
+
+# Type and scale of every data unit in a frame
+# Value in frame is the real value divided by scale, so 0.01 means two decimals
+# Biggest value of unsigned types and smallest value of signed types means
+# that the data unit is missing
+FRAME_FIELDS = [(field.dtype, field.scale) for field in FIELDS]
+
+# Frame as a NumPy structured type, so many frames can be read with one frombuffer
+FRAME_DTYPE = numpy.dtype([("sync", "S2"), ("length", "u1"), ("seq", "<u2")]
+                          + [(name, dtype) for name, (dtype, _) in zip(CHANNELS, FRAME_FIELDS)]
+                          + [("crc", "<u2")])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+PAYLOAD_SIZE = FRAME_SIZE - 7
+
+_SCALES = numpy.array([scale for _, scale in FRAME_FIELDS])
+# How many decimals data units have when frames are changed to text packets
+_DECIMALS = [max(0, round(-numpy.log10(scale))) for _, scale in FRAME_FIELDS]
+
+
+def _missing(dtype):
+    info = numpy.iinfo(dtype)
+    return info.max if info.min == 0 else info.min
+
+
+_MISSING = [_missing(dtype) for dtype, _ in FRAME_FIELDS]
+
+
+def _crc_table():
+    table = numpy.zeros(256, dtype=numpy.uint16)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1
+        table[i] = crc & 0xFFFF
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+# CRC-16/CCITT-FALSE of every row of data, data is a 2D uint8 array
+# All rows are done together, one NumPy step per byte
+def crc16(data):
+    crc = numpy.full(len(data), 0xFFFF, dtype=numpy.uint16)
+    for i in range(data.shape[1]):
+        crc = (crc << 8) ^ _CRC_TABLE[(crc >> 8) ^ data[:, i]]
+    return crc
+
+
+# Makes frames from values, one row of data units per frame
+# NaN data units are sent as missing, values that don't fit are clipped
+# Used for testing, and it shows how Cansat should make frames
+def encode_frames(values, first_seq=0):
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, len(FRAME_FIELDS))
+    frames = numpy.zeros(len(values), dtype=FRAME_DTYPE)
+    frames["sync"] = SYNC
+    frames["length"] = PAYLOAD_SIZE
+    frames["seq"] = (first_seq + numpy.arange(len(values))) % 65536
+    for i, (name, (dtype, scale)) in enumerate(zip(CHANNELS, FRAME_FIELDS)):
+        info = numpy.iinfo(dtype)
+        # Missing value is kept free, so real values never look missing
+        low, high = (info.min, info.max - 1) if info.min == 0 else (info.min + 1, info.max)
+        column = numpy.round(values[:, i] / scale)
+        frames[name] = numpy.where(numpy.isnan(column), _MISSING[i], numpy.clip(numpy.nan_to_num(column), low, high))
+    raw = frames.view(numpy.uint8).reshape(len(frames), FRAME_SIZE)
+    frames["crc"] = crc16(raw[:, 2:-2])
+    return frames.tobytes()
+
+
+# Finds frames in data
+# Returns offsets of frames that have correct length and CRC, (start, stop) of
+# frames that had a bad CRC, and offset of a frame that hasn't fully arrived yet, or None
+# A frame with a bad CRC ends where the next sync is, if that is sooner than a
+# whole frame, so a frame that was cut short doesn't hide the frame after it
+def find_frames(data):
+    buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+    starts = numpy.flatnonzero((buffer[:-1] == SYNC[0]) & (buffer[1:] == SYNC[1]))
+    complete = starts[starts + FRAME_SIZE <= len(buffer)]
+    incomplete = int(starts[len(complete)]) if len(complete) < len(starts) else None
+    # Last byte may be the first half of sync of the next frame
+    if incomplete is None and data[-1:] == SYNC[:1]:
+        incomplete = len(data) - 1
+    if len(complete) == 0:
+        return [], [], incomplete
+    # Every possible frame is checked together
+    raw = buffer[complete[:, None] + numpy.arange(FRAME_SIZE)]
+    length_ok = raw[:, 2] == PAYLOAD_SIZE
+    good = length_ok & (crc16(raw[:, 2:-2]) == raw[:, -2:].copy().view("<u2")[:, 0])
+    next_sync = numpy.append(starts, len(buffer))[numpy.searchsorted(starts, complete, side="right")]
+    offsets = []
+    rejected = []
+    end = 0
+    # Frames can't overlap, sync bytes inside a frame are not a new frame
+    for offset, ok, is_good, stop in zip(complete.tolist(), length_ok.tolist(), good.tolist(), next_sync.tolist()):
+        if offset < end or not ok:
+            continue
+        if is_good:
+            offsets.append(offset)
+            end = offset + FRAME_SIZE
+        else:
+            end = min(offset + FRAME_SIZE, stop)
+            rejected.append((offset, end))
+    if incomplete is not None and incomplete < end:
+        incomplete = None
+    return offsets, rejected, incomplete
+
+
+# Reads frames at offsets in data
+# Returns sequence numbers and values with one row of data units per frame,
+# missing data units are NaN
+def decode_frames(data, offsets):
+    buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+    raw = buffer[numpy.asarray(offsets, dtype=numpy.intp)[:, None] + numpy.arange(FRAME_SIZE)]
+    frames = numpy.frombuffer(raw.tobytes(), dtype=FRAME_DTYPE)
+    values = numpy.empty((len(frames), len(FRAME_FIELDS)))
+    for i, name in enumerate(CHANNELS):
+        column = frames[name]
+        values[:, i] = numpy.where(column == _MISSING[i], numpy.nan, column * _SCALES[i])
+    return frames["seq"].astype(numpy.int64), values
+
+
+# Changes decoded values to text packets, so they are saved and shown like
+# packets that came as text. Missing data units are left empty
+def format_packets(values):
+    formats = [f"{{:.{decimals}f}}" for decimals in _DECIMALS]
+    packets = []
+    for row in values.tolist():
+        packets.append(",".join("" if value != value else form.format(value) for form, value in zip(formats, row)))
+    return packets
+
+
+# How many frames were lost between sequence numbers, previous is the last
+# sequence number before seq, or None
+# Frames that had a bad CRC are dropped, so they are also counted here
+# Sequence number 0 means that Cansat was restarted, so nothing is counted as lost
+def count_lost(seq, previous=None):
+    if len(seq) == 0:
+        return 0
+    if previous is not None:
+        seq = numpy.concatenate(([previous], seq))
+    gaps = (numpy.diff(seq) - 1) % 65536
+    # Repeated frames and restarts are not lost frames
+    gaps[(gaps == 65535) | (seq[1:] == 0)] = 0
+    return int(gaps.sum())
@@ -0,0 +1,246 @@
+# Saves received data to disk
+# Runs in its own thread, so serial thread only has to put packets in a queue
+# Rows are written in batches and file is synced to disk only every few seconds
+import csv
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import numpy
+
+from frames import format_packets
+from metrics import METRICS
+from packets import FIELD_COUNT, PacketBatch, parse_packets
+from schema import FIELDS
+
+
+# Columns of log file, data units are in the same order as in a packet
+# Raw column has the whole packet, but only if some part of it was corrupted
+HEADER = ["Time"] + [field.header for field in FIELDS] + ["Raw"]
+
+# Put in queue to stop logger thread
+_STOP = object()
+
+
+# Time in log file, packets of one read from serial port have the same time
+@lru_cache(maxsize=64)
+def _time_string(received):
+    return datetime.fromtimestamp(received).isoformat(sep=" ", timespec="milliseconds")
+
+
+# Writes samples to numbered .npz files in a folder, one file per chunk of rows
+# Every file has "timestamps" and "values" arrays, missing data units are NaN
+class NpzSink:
+    def __init__(self, folder, chunk_rows=10000):
+        self.folder = folder
+        self.chunk_rows = chunk_rows
+        self.timestamps = []
+        self.values = []
+        os.makedirs(folder, exist_ok=True)
+        # Continues numbering if folder already has chunks in it
+        self.chunk = len([name for name in os.listdir(folder) if name.endswith(".npz")])
+
+    # Adds a batch of samples, values has one row of data units per sample
+    def write(self, timestamps, values):
+        self.timestamps.append(numpy.asarray(timestamps, dtype=numpy.float64))
+        self.values.append(values)
+        if sum(len(t) for t in self.timestamps) >= self.chunk_rows:
+            self.flush()
+
+    # Saves rows that have been collected to a new chunk file
+    def flush(self):
+        if not self.timestamps:
+            return
+        path = os.path.join(self.folder, f"{self.chunk:05d}.npz")
+        numpy.savez(path, timestamps=numpy.concatenate(self.timestamps), values=numpy.concatenate(self.values))
+        self.chunk += 1
+        self.timestamps = []
+        self.values = []
+
+
+# Loads all chunks written by NpzSink
+# Returns timestamps and values with one row per sample
+def load_npz(folder):
+    timestamps = []
+    values = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".npz"):
+            with numpy.load(os.path.join(folder, name)) as chunk:
+                timestamps.append(chunk["timestamps"])
+                values.append(chunk["values"])
+    if not timestamps:
+        return numpy.empty(0), numpy.empty((0, FIELD_COUNT))
+    return numpy.concatenate(timestamps), numpy.concatenate(values)
+
+
+class TelemetryLogger:
+    # file_name - csv file where data is saved
+    # flush_rows - rows are written when this many have been collected
+    # flush_interval - seconds after which collected rows are written anyway
+    # fsync_interval - seconds between making sure that written data is on disk
+    # npz_folder - if set, data is also saved to .npz chunks in this folder
+    def __init__(self, file_name, flush_rows=100, flush_interval=1.0, fsync_interval=10.0, npz_folder=None):
+        self.file_name = file_name
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.npz = NpzSink(npz_folder) if npz_folder else None
+        self._queue = queue.Queue()
+        # Items from queue that haven't been written, (received, packet) or PacketBatch
+        self._rows = []
+        self._row_count = 0
+        self._thread = None
+
+    def start(self):
+        # Header is only written to a new file
+        new_file = not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0
+        self._file = open(self.file_name, "a", newline="", encoding="UTF8")
+        self._writer = csv.writer(self._file)
+        if new_file:
+            self._writer.writerow(HEADER)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # Called by serial thread for every received packet
+    def log(self, received, packet):
+        self._queue.put((received, packet))
+
+    # Called by serial thread for binary frames, batch is a PacketBatch that has
+    # values but no packets. Text of rows is made in logger thread
+    def log_batch(self, batch):
+        self._queue.put(batch)
+
+    # Writes everything that is left and closes file
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        last_flush = last_fsync = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                self._rows.append(item)
+                self._row_count += len(item.timestamps) if isinstance(item, PacketBatch) else 1
+
+            now = time.monotonic()
+            if self._row_count >= self.flush_rows or (self._rows and now - last_flush >= self.flush_interval):
+                self._flush()
+                last_flush = now
+            if now - last_fsync >= self.fsync_interval:
+                self._sync()
+                last_fsync = now
+
+        self._flush()
+        if self.npz:
+            self.npz.flush()
+        self._sync()
+        self._file.close()
+
+    # Writes collected packets, all of them are parsed together
+    def _flush(self):
+        if not self._rows:
+            return
+        METRICS.gauge("log.queue", self._queue.qsize())
+        with METRICS.timer("log.flush"):
+            # Packets and batches are written in the order they arrived
+            start = 0
+            for i, item in enumerate(self._rows + [None]):
+                if item is not None and not isinstance(item, PacketBatch):
+                    continue
+                if i > start:
+                    self._write_rows(self._rows[start:i])
+                if item is not None:
+                    self._write_batch(item)
+                start = i + 1
+            self._file.flush()
+        METRICS.count("log.rows", self._row_count)
+        self._rows = []
+        self._row_count = 0
+
+    def _write_rows(self, items):
+        packets = [packet for _, packet in items]
+        parsed = parse_packets(packets)
+        rows = []
+        for (received, packet), valid, ok in zip(items, parsed.valid, parsed.ok):
+            time_string = _time_string(received)
+            if ok:
+                rows.append([time_string] + packet.split(",") + [""])
+            else:
+                # Data units that couldn't be read are left empty and whole packet is saved
+                fields = packet.split(",")
+                row = [time_string]
+                row.extend(fields[i] if valid[i] else "" for i in range(FIELD_COUNT))
+                row.append(packet)
+                rows.append(row)
+        self._writer.writerows(rows)
+        if self.npz:
+            self.npz.write([received for received, _ in items], parsed.values)
+
+    # Frames were checked with CRC, so they never have a raw packet
+    # Missing data units are left empty
+    def _write_batch(self, batch):
+        rows = []
+        for received, packet in zip(batch.timestamps.tolist(), format_packets(batch.values)):
+            rows.append([_time_string(received)] + packet.split(",") + [""])
+        self._writer.writerows(rows)
+        if self.npz:
+            self.npz.write(batch.timestamps, batch.values)
+
+    def _sync(self):
+        with METRICS.timer("log.fsync"):
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+# One logger for every base station
+# Data of the first base station is saved to file_name, and data of others to
+# files that have the name of their serial port added, like data1234_COM5.csv
+class LoggerPerSource:
+    def __init__(self, file_name, npz=False, **options):
+        self.file_name = file_name
+        self.npz = npz
+        self.options = options
+        self.loggers = {}
+
+    # Extension of file_name is kept, whatever it is
+    def _file_name(self, source):
+        if not self.loggers:
+            return self.file_name
+        base, extension = os.path.splitext(self.file_name)
+        # Port names like /dev/ttyUSB0 can't be used in file names as they are
+        return base + "_" + "".join(c if c.isalnum() else "_" for c in str(source)).strip("_") + extension
+
+    # Logger of a base station, it is started when its first data arrives
+    def _logger(self, source):
+        logger = self.loggers.get(source)
+        if logger is None:
+            name = self._file_name(source)
+            logger = TelemetryLogger(name, npz_folder=os.path.splitext(name)[0] + "_npz" if self.npz else None, **self.options)
+            logger.start()
+            print("Saving data from", source or "base station", "to", name)
+            self.loggers[source] = logger
+        return logger
+
+    # Called for every packet, source is the serial port it came from
+    def log(self, received, packet, source=None):
+        self._logger(source).log(received, packet)
+
+    # Called for decoded binary frames, batch.source is the serial port they came from
+    def log_batch(self, batch):
+        self._logger(batch.source).log_batch(batch)
+
+    def close(self):
+        for logger in self.loggers.values():
+            logger.close()
@@ -2,8 +2,7 @@
 # PyQt5 libaries
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import QWidget, QGridLayout
-from PyQt5.QtCore import QTimer
-from pyqtgraph import AxisItem
+from PyQt5.QtCore import QEvent, Qt, QTimer, QUrl
 from pyqtgraph import QtWidgets
 import pyqtgraph as pg
 from PyQt5.QtWebEngineWidgets import QWebEngineView
@@ -13,291 +12,383 @@ import numpy
 import sys
 import os
 import threading
-import serial
+import argparse
 import random
-from datetime import datetime, timedelta
 import time
-from time import mktime
-import folium
-import io
-import csv
-from jinja2 import Template
-
-
-# String for receiving serial data
-base_station_data = ""
-
-# Raw data - all data that comes in from serial port, it can be corrupted
-# It can still be useful to get data, even if not everything can be used
-raw_data = []
-
-# Displayed data - data that shouldn't be corrupted
-# Non-corrupted data received from serial port is appended to this list
-# Latest data is split and gets appended to data lists, to be used by graphs
-displayed_data = []
+from collections import deque
+
+from storage import TelemetryStore
+from dateaxis import DateAxisItem
+from schema import CHANNELS, DERIVED, DERIVED_CHANNELS, FIELDS, PLOTS
+from derived import DerivedMetrics
+from render import SummaryPyramid, decimate
+from logger import LoggerPerSource
+from packets import PacketBatch, parse_batch
+from frames import format_packets
+from replay import read_log, replay, synthetic_packets
+from maptrack import TrackLayer
+from mapserver import MAP_NAME, MapServer
+from serialport import run_serial
+from recorder import RECORDER_ADDRESS, follow_recorder, parse_address
+from shmring import SHM_NAME, follow_shm
+from session import load_session
+from metrics import METRICS
+
+
+# How many lines consoles in app show, older lines are removed from them
+CONSOLE_LINES = 1000
+
+# How many received packets can wait for the gui before the oldest ones are dropped
+# Gui empties the queue every tick, so this only fills up if the gui freezes
+QUEUE_SIZE = 10000
+
+# Queue between serial thread and gui
+# Serial thread puts (time received, packet) in it and gui takes out
+# everything that has arrived since the last tick, packets are checked when they are parsed
+# deque.append and deque.popleft are thread-safe, so no lock is needed
+data_queue = deque(maxlen=QUEUE_SIZE)
+
+# Queue for packets that have already been parsed, as PacketBatch
+# Used when app is attached to a recorder, which parses packets itself
+batch_queue = deque(maxlen=QUEUE_SIZE)
+
+# How many minutes of data graphs show when they follow live data
+# Older data can still be seen by zooming out or pressing "Whole flight"
+LIVE_WINDOW_MINUTES = 5
+
+# How often gui takes received packets from queue, in milliseconds
+DRAIN_INTERVAL = 50
+# Most packets taken from queue in one tick, so a burst of data doesn't freeze gui
+DRAIN_LIMIT = 20000
+
+# Shortest and longest time between frames when graphs have changed, in seconds
+# Graphs are drawn at up to 30 frames per second and at least once a second
+MIN_FRAME_INTERVAL = 1 / 30
+MAX_FRAME_INTERVAL = 1.0
+# Part of time of gui thread that drawing graphs may take
+RENDER_BUDGET = 0.5
+
+# If a graph has to draw more points per pixel of its width than this, antialiasing
+# is turned off and lines are made thin, because wide antialiased lines are slow to draw
+# Min/max envelopes of zoomed out graphs have two points per pixel, so they are always thin
+ANTIALIAS_POINTS_PER_PIXEL = 1.0
 
 # Serial port being uses
 # The new school laptop uses COM4, my computer uses COM8
-com_port = "COM4"
+# If None, base stations are found by USB id of their serial chip
+com_port = None
+baudrate = 9600
 
-file_name = f"data{random.randint(1000, 10000)}.csv"
-with open(file_name, "a", newline="", encoding="UTF8") as csv_f:
-           writer = csv.writer(csv_f)
-           writer.writerow(["Time","Latititude","Longitude","Speed","Altitude","Temp","Humidity","Pressure","eCO2","CO2","TVOC","NO2","PM10","PM25","PM100","RSSI","SNR"])
-
-# This class makes it possible for graphs to display time as x-axis
-# Don't touch this class, it works as it should.
-class DateAxisItem(AxisItem):
-    # Max width in pixels reserved for each label in axis
-    _pxLabelWidth = 80
-
-    def __init__(self, *args, **kwargs):
-        AxisItem.__init__(self, *args, **kwargs)
-        self._oldAxis = None
-
-    def tickValues(self, minVal, maxVal, size):
-        maxMajSteps = int(size/self._pxLabelWidth)
-
-        dt1 = datetime.fromtimestamp(minVal)
-        dt2 = datetime.fromtimestamp(maxVal)
-
-        dx = maxVal - minVal
-        majticks = []
-
-        if dx > 63072001:  # 3600s*24*(365+366) = 2 years (count leap year)
-            d = timedelta(days=366)
-            for y in range(dt1.year + 1, dt2.year):
-                dt = datetime(year=y, month=1, day=1)
-                majticks.append(mktime(dt.timetuple()))
-
-        elif dx > 5270400:  # 3600s*24*61 = 61 days
-            d = timedelta(days=31)
-            dt = dt1.replace(day=1, hour=0, minute=0,
-                             second=0, microsecond=0) + d
-            while dt < dt2:
-                # make sure that we are on day 1 (even if always sum 31 days)
-                dt = dt.replace(day=1)
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
-
-        elif dx > 172800:  # 3600s24*2 = 2 days
-            d = timedelta(days=1)
-            dt = dt1.replace(hour=0, minute=0, second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
-
-        elif dx > 7200:  # 3600s*2 = 2hours
-            d = timedelta(hours=1)
-            dt = dt1.replace(minute=0, second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
-
-        elif dx > 1200:  # 60s*20 = 20 minutes
-            d = timedelta(minutes=10)
-            dt = dt1.replace(minute=(dt1.minute // 10) * 10,
-                             second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
-
-        elif dx > 120:  # 60s*2 = 2 minutes
-            d = timedelta(minutes=1)
-            dt = dt1.replace(second=0, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
-
-        elif dx > 20:  # 20s
-            d = timedelta(seconds=10)
-            dt = dt1.replace(second=(dt1.second // 10) * 10, microsecond=0) + d
-            while dt < dt2:
-                majticks.append(mktime(dt.timetuple()))
-                dt += d
-
-        elif dx > 2:  # 2s
-            d = timedelta(seconds=1)
-            majticks = range(int(minVal), int(maxVal))
-
-        else:  # <2s , use standard implementation from parent
-            return AxisItem.tickValues(self, minVal, maxVal, size)
-
-        L = len(majticks)
-        if L > maxMajSteps:
-            majticks = majticks[::int(numpy.ceil(float(L) / maxMajSteps))]
-
-        return [(d.total_seconds(), majticks)]
-
-    def tickStrings(self, values, scale, spacing):
-        ret = []
-        if not values:
-            return []
-
-        if spacing >= 31622400:  # 366 days
-            fmt = "%Y"
-
-        elif spacing >= 2678400:  # 31 days
-            fmt = "%Y %b"
-
-        elif spacing >= 86400:  # = 1 day
-            fmt = "%b/%d"
-
-        elif spacing >= 3600:  # 1 h
-            fmt = "%b/%d-%Hh"
-
-        elif spacing >= 60:  # 1 m
-            fmt = "%H:%M"
-
-        elif spacing >= 1:  # 1s
-            fmt = "%H:%M:%S"
+# Serial port of base station whose data is shown in graphs
+# If None, the first base station that sends data is shown
+# Data of all base stations is saved to files
+shown_source = None
 
-        else:
-            # less than 2s (show microseconds)
-            # fmt = '%S.%f"'
-            fmt = '[+%fms]'  # explicitly relative to last second
+file_name = f"data{random.randint(1000, 10000)}.csv"
 
-        for x in values:
-            try:
-                t = datetime.fromtimestamp(x)
-                ret.append(t.strftime(fmt))
-            except ValueError:  # Windows can't handle dates before 1970
-                ret.append('')
+# If True, data is also saved as .npz chunks in a folder next to csv file
+# They are much faster to load after the flight than csv
+binary_log = False
 
-        return ret
+# Json file where timings and counters are saved, None if they aren't saved
+# They can also be seen in app with "Metrics" checkbox
+metrics_file = None
+# How often metrics are saved to metrics_file, in seconds
+METRICS_INTERVAL = 10.0
 
-    def attachToPlotItem(self, plotItem):
-        pen_line = pg.mkPen(color=(0, 0, 0), width=3)
-        self.setParentItem(plotItem)
-        viewBox = plotItem.getViewBox()
-        self.linkToView(viewBox)
-        self._oldAxis = plotItem.axes[self.orientation]['item']
-        self._oldAxis.hide()
-        plotItem.axes[self.orientation]['item'] = self
-        pos = plotItem.axes[self.orientation]['pos']
-        plotItem.layout.addItem(self, *pos)
-        self.setZValue(-1000)
-        plotItem.getAxis('bottom').setPen(pen_line)
+# Column of every channel in store, received channels first and derived after them
+_COLUMN = {name: i for i, name in enumerate(CHANNELS + DERIVED_CHANNELS)}
 
-    def detachFromPlotItem(self):
-        raise NotImplementedError()  # TODO
+# Console that shows received packets
+# Only the last lines are kept, so it doesn't get slower during a long flight
+# If it is scrolled up, it stays there while new lines are added
+class LogView(QtWidgets.QPlainTextEdit):
+    def __init__(self, max_lines=CONSOLE_LINES):
+        super().__init__()
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        self.setMaximumBlockCount(max_lines)
+        self.paused = False
+        # Lines that arrive while paused are shown when console is unpaused
+        self.pending = deque(maxlen=max_lines)
+
+    # Adds many lines at once
+    def append_lines(self, lines):
+        if self.paused:
+            self.pending.extend(lines)
+            return
+        if lines:
+            self.appendPlainText("\n".join(lines))
+
+    def set_paused(self, paused):
+        self.paused = paused
+        if not paused:
+            pending = list(self.pending)
+            self.pending.clear()
+            self.append_lines(pending)
 
 
 # Main window
 class Window(QWidget):
     def __init__(self):
         super().__init__()
-        # Lists where all data is stored
-        self.timestamps = []
-        self.data_latitude = []
-        self.data_longitude = []
-        self.data_speed = []
-        self.data_temp = []
-        self.data_humid = []
-        self.data_alt = []
-        self.data_press = []
-        self.data_eco2 = []
-        self.data_co2 = []
-        self.data_tvoc = []
-        self.data_no2 = []
-        self.data_pm10 = []
-        self.data_pm25 = []
-        self.data_pm100 = []
-        self.data_rssi = []
-        self.data_snr = []
-
-        # Starts a timer that updates lists and the graphs every second
+        # Columnar store where all data is stored
+        # Every channel is a NumPy array, so graphs don't have to convert lists every tick
+        # Derived channels are stored after received channels
+        self.store = TelemetryStore(CHANNELS + DERIVED_CHANNELS)
+        # Calculates derived channels for every new batch of samples
+        self.derived = DerivedMetrics()
+
+        # Graphs whose data or range has changed since they were last drawn
+        self.dirty_plots = set()
+        # Time of last new sample that graphs that follow live data have been moved to
+        self.live_end = None
+        # How long drawing a frame takes, smoothed over last frames, in seconds
+        self.frame_cost = None
+        # When the last frame was started, from time.perf_counter()
+        self.last_frame = None
+
+        # Takes received packets out of the queue many times a second, so data is
+        # stored soon after it arrives and bursts are handled in small pieces
+        # Drawing is done separately by frame_timer, only when something has changed
         self.qTimer = QTimer()
-        self.qTimer.setInterval(1000)  # milliseconds
+        self.qTimer.setInterval(DRAIN_INTERVAL)  # milliseconds
         self.qTimer.start()
         self.qTimer.timeout.connect(self.update_data_real)
+        self.frame_timer = QTimer()
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.timeout.connect(self.render_frame)
 
         # Run the ui
         self.initUI()
 
-    # For use with base station itself
-    # For this function to work it needs to be set above in qTimer.timeout
-    # and also base station has to be connected to PC and
-    # Cansat has to be transmitting data
+    # Takes out packets that have arrived since last tick and stores them
+    # Graphs are not drawn here, plots that got new data are marked dirty and a frame is requested
     def update_data_real(self):
-        try:
-            # Splits last received data
-            split_data = displayed_data[-1].split(",")
-            # Converts every data unit to float
-            split_data = [float(x) for x in split_data]
-            # Gets time when data was received
-            self.timestamps.append(time.time())
-            # Appends split data to data lists
-            self.data_latitude.append(split_data[0])
-            self.data_longitude.append(split_data[1])
-            self.data_speed.append(split_data[2])
-            self.data_alt.append(split_data[3])
-            self.data_temp.append(split_data[4])
-            self.data_humid.append(split_data[5])
-            self.data_press.append(split_data[6])
-            self.data_eco2.append(split_data[7])
-            self.data_co2.append(split_data[8])
-            self.data_tvoc.append(split_data[9])
-            self.data_no2.append(split_data[10])
-            self.data_pm10.append(split_data[11])
-            self.data_pm25.append(split_data[12])
-            self.data_pm100.append(split_data[13])
-            self.data_rssi.append(split_data[14])
-            self.data_snr.append(split_data[15])
-
-            # Makes sure that it doesn't try to change data to lists with no values
-            if len(self.data_latitude) > 0:
-                # Updates all graphs with new data
-                self.temp_plot.setData(self.timestamps, self.data_temp)
-                self.press_plot.setData(self.timestamps, self.data_press)
-                self.humid_plot.setData(self.timestamps, self.data_humid)
-                self.alt_plot.setData(self.timestamps, self.data_alt)
-                self.spd_plot.setData(self.timestamps, self.data_speed)
-                self.co2_plot_line.setData(self.timestamps, self.data_co2)
-                self.eco2_plot_line.setData(self.timestamps, self.data_eco2)
-                self.tvoc_plot_line.setData(self.timestamps, self.data_tvoc)
-                self.no2_plot_line.setData(self.timestamps, self.data_no2)
-                self.pm10_plot_line.setData(self.timestamps, self.data_pm10)
-                self.pm25_plot_line.setData(self.timestamps, self.data_pm25)
-                self.pm100_plot_line.setData(self.timestamps, self.data_pm100)
-                # If GPS signal is acquired add a marker in the map
-                if int(self.data_latitude[-1]) != 0:
-                    #self.add_marker()
-                    pass
-
-                # Prints received data to consoles in app
-                self.raw_console.append(raw_data[-1])
-                self.displayed_console.append(displayed_data[-1])
-        except:
-            pass
-
-    # Function that can put a marker on map
-    def add_marker(self):
-        js = Template(
-            """
-        L.marker([{{latitude}}, {{longitude}}] )
-            .addTo({{map}});
-        L.circleMarker(
-            [{{latitude}}, {{longitude}}], {
-                "bubblingMouseEvents": true,
-                "color": "#3388ff",
-                "dashArray": null,
-                "dashOffset": null,
-                "fill": false,
-                "fillColor": "#3388ff",
-                "fillOpacity": 0.2,
-                "fillRule": "evenodd",
-                "lineCap": "round",
-                "lineJoin": "round",
-                "opacity": 1.0,
-                "radius": 2,
-                "stroke": true,
-                "weight": 5
-            }
-        ).addTo({{map}});
-        """
-        ).render(map=self.map.get_name(), latitude=self.data_latitude[-1], longitude=self.data_longitude[-1])
-        self.mapView.page().runJavaScript(js)
+        METRICS.gauge("queue.depth", len(data_queue) + len(batch_queue))
+        with METRICS.timer("gui.update"):
+            self._update_data()
+
+    def _update_data(self):
+        # At most DRAIN_LIMIT packets are taken at once, the rest are left for next ticks
+        batches = []
+        drained = 0
+        while batch_queue and drained < DRAIN_LIMIT:
+            batches.append(batch_queue.popleft())
+            drained += len(batches[-1].timestamps)
+        packets = []
+        while data_queue and drained + len(packets) < DRAIN_LIMIT:
+            packets.append(data_queue.popleft())
+        # Converts all packets to numbers at once
+        # Corrupted data units are NaN, so the rest of a packet can still be shown
+        if packets:
+            batches.append(parse_batch([received for received, _ in packets],
+                                       [packet for _, packet in packets]))
+
+        # If nothing new has arrived, graphs don't need to be updated
+        if not batches:
+            return
+
+        # Prints received data to consoles in app, all lines at once
+        # Binary frames and batches from shared memory don't have packets, so their
+        # numbers are made to text, only as many as consoles can show
+        for b in batches:
+            if b.packets or len(b.timestamps) == 0:
+                packets, ok = b.packets, b.ok
+            else:
+                packets, ok = format_packets(b.values[-CONSOLE_LINES:]), b.ok[-CONSOLE_LINES:]
+            self.raw_console.append_lines(packets)
+            self.displayed_console.append_lines([packet for packet, ok in zip(packets, ok) if ok])
+
+        if len(batches) == 1:
+            batch = batches[0]
+        else:
+            # Packets of the whole batch are not used after consoles, so they aren't joined
+            batch = PacketBatch(numpy.concatenate([b.timestamps for b in batches]),
+                                [],
+                                numpy.concatenate([b.values for b in batches]),
+                                numpy.concatenate([b.valid for b in batches]),
+                                numpy.concatenate([b.ok for b in batches]))
+
+        # Time from receiving a packet to showing it
+        # Replayed packets and recorder on another computer can have times in the future
+        METRICS.observe_many("latency", numpy.maximum(time.time() - batch.timestamps, 0.0))
+
+        # Packets where nothing could be read are not added
+        usable = batch.valid.any(axis=1)
+        values = batch.values[usable]
+        timestamps = batch.timestamps[usable]
+        if len(timestamps) == 0:
+            return
+        with METRICS.timer("derived"):
+            derived = self.derived.update(timestamps, values)
+        rows = numpy.hstack((values, derived))
+        # Appends all channels of the whole batch together,
+        # using time when data was received by serial thread
+        with METRICS.timer("store.append"):
+            self.store.append(timestamps, rows)
+
+        # Adds positions where GPS signal is acquired to track on the map
+        # All new points are sent to map together
+        self.track.add_points(values[:, _COLUMN["latitude"]], values[:, _COLUMN["longitude"]])
+        self.track.flush()
+
+        # Adds new samples to cached min/max values of every channel
+        with METRICS.timer("pyramids"):
+            for channel, pyramid in self.pyramids.items():
+                pyramid.update(self.store.column(channel))
+
+        # Graphs that follow live data move, so all of them change
+        # Otherwise only graphs that got values in the time they show have to be drawn again
+        if self.follow_live.isChecked():
+            self.dirty_plots.update(self.plots)
+        else:
+            x0, x1 = self.main_plot.viewRange()[0]
+            shown = (timestamps >= x0) & (timestamps <= x1)
+            if shown.any():
+                for _, channel, _, _ in self.curves:
+                    if numpy.isfinite(rows[shown, _COLUMN[channel.name]]).any():
+                        self.dirty_plots.add(channel.plot)
+        self.request_frame()
+
+    # Time between frames, frames are made less often when drawing takes long,
+    # so drawing never uses more than RENDER_BUDGET of the time of gui thread
+    # Frames are only made when data has changed, so with slow data they are rarer anyway
+    def frame_interval(self):
+        if self.frame_cost is None:
+            return MIN_FRAME_INTERVAL
+        return min(max(self.frame_cost / RENDER_BUDGET, MIN_FRAME_INTERVAL), MAX_FRAME_INTERVAL)
+
+    # Starts frame_timer so a frame is drawn as soon as frame interval allows
+    def request_frame(self):
+        if self.frame_timer.isActive() or not self.dirty_plots:
+            return
+        delay = 0.0
+        if self.last_frame is not None:
+            delay = max(self.last_frame + self.frame_interval() - time.perf_counter(), 0.0)
+        self.frame_timer.start(int(delay * 1000))
+
+    # Draws graphs that are dirty and can be seen
+    # Graphs that are hidden stay dirty and are drawn when they can be seen again
+    def render_frame(self):
+        window = self.windowHandle()
+        if len(self.store) == 0 or self.isMinimized() or window is None or not window.isExposed():
+            return
+        start = time.perf_counter()
+        if self.last_frame is not None:
+            METRICS.observe("gui.frame_interval", start - self.last_frame)
+        self.last_frame = start
+
+        # Moves graphs to show the last few minutes
+        end = self.store.timestamps[-1]
+        if self.follow_live.isChecked() and end != self.live_end:
+            self.changing_range = True
+            self.main_plot.setXRange(end - self.live_window.value() * 60, end, padding=0)
+            self.changing_range = False
+            self.live_end = end
+
+        plots = {name for name in self.dirty_plots if self.plots[name].isVisible()}
+        self.dirty_plots -= plots
+        with METRICS.timer("render.redraw"):
+            self._redraw_curves(plots)
+        # Zero timer runs after Qt has painted the changed graphs, so frame cost includes painting
+        QTimer.singleShot(0, lambda: self._frame_done(start))
+
+    def _frame_done(self, start):
+        cost = time.perf_counter() - start
+        METRICS.observe("render.frame", cost)
+        self.frame_cost = cost if self.frame_cost is None else 0.8 * self.frame_cost + 0.2 * cost
+        METRICS.gauge("render.fps_limit", 1.0 / self.frame_interval())
+
+    # Draws all graphs again, when range that graphs show or the way they are drawn changes
+    def redraw_plots(self):
+        if self.changing_range:
+            return
+        self.dirty_plots.update(self.plots)
+        self.request_frame()
+
+    # Draws part of data that is visible in graphs
+    # Only as many points as graph has pixels are drawn, so drawing doesn't get
+    # slower the longer flight goes on
+    def _redraw_curves(self, plots):
+        # All graphs have linked x-axis, so they all show the same time
+        x0, x1 = self.main_plot.viewRange()[0]
+        t = self.store.timestamps
+        for curve, channel, pen, thin_pen in self.curves:
+            if channel.plot not in plots:
+                continue
+            width = curve.getViewBox().width()
+            with METRICS.timer("render.decimate"):
+                x, y = decimate(t, self.store.column(channel.name), self.pyramids[channel.name], x0, x1, width,
+                                mean=self.averages.isChecked())
+            # Lots of points are drawn with thin lines and without antialiasing
+            thin = len(x) > width * ANTIALIAS_POINTS_PER_PIXEL
+            if thin != (curve in self.thin_curves):
+                if thin:
+                    self.thin_curves.add(curve)
+                else:
+                    self.thin_curves.discard(curve)
+                curve.opts["antialias"] = pg.getConfigOption("antialias") and not thin
+                curve.setPen(thin_pen if thin else pen)
+            with METRICS.timer("render.setData"):
+                curve.setData(x, y, connect="finite")
+            METRICS.count("render.points", len(x))
+
+    # Graphs that changed while window was minimized are drawn when it is opened again
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if event.type() == QEvent.WindowStateChange and not self.isMinimized():
+            self.request_frame()
+
+    # Shows metrics in overlay and saves them to metrics_file, called every second
+    def update_metrics(self):
+        if self.metrics_overlay.isVisible():
+            snapshot = METRICS.snapshot()
+            self.metrics_overlay.setText("\n".join(METRICS.format_lines(self.metrics_previous)))
+            self.metrics_overlay.adjustSize()
+            self.metrics_overlay.raise_()
+            self.metrics_previous = snapshot
+        if metrics_file and time.monotonic() - self.metrics_exported >= METRICS_INTERVAL:
+            METRICS.export(metrics_file)
+            self.metrics_exported = time.monotonic()
+
+    def show_metrics(self, shown):
+        self.metrics_overlay.setVisible(shown)
+        self.metrics_previous = None
+        self.update_metrics()
+
+    # Moves graphs to the latest data again when following is turned on or live window
+    # is changed, also when no new data is arriving
+    def follow_changed(self):
+        self.live_end = None
+        self.redraw_plots()
+
+    # If graph is moved or zoomed by hand, it stops following live data
+    def stop_following(self):
+        self.follow_live.setChecked(False)
+
+    # Zooms out to show all data that has been received
+    def show_whole_flight(self):
+        if len(self.store) == 0:
+            return
+        self.follow_live.setChecked(False)
+        self.main_plot.setXRange(self.store.timestamps[0], self.store.timestamps[-1])
+
+    # Shows a recorded session instead of live data
+    # Cached min/max/mean pyramids are used, so even very long sessions can be zoomed and moved quickly
+    def open_session(self, path):
+        session = load_session(path)
+        # Data is used as it is loaded, without copying
+        self.derived.clear()
+        self.store = session.store
+        for channel in self.pyramids:
+            self.pyramids[channel] = session.pyramids[channel]
+        self.track.set_points(*session.track)
+        self.track.flush(force=True, replace=True)
+        self.setWindowTitle(f"Base station data - {os.path.basename(os.path.normpath(path))}")
+        self.show_whole_flight()
+        self.redraw_plots()
 
     # Function that adds all gui elements
     def initUI(self):
@@ -312,8 +403,8 @@ class Window(QWidget):
         self.setPalette(p)
 
         # Creates new text blocks to be used as consoles to display received data
-        self.raw_console = QtWidgets.QTextEdit()
-        self.displayed_console = QtWidgets.QTextEdit()
+        self.raw_console = LogView()
+        self.displayed_console = LogView()
 
         # Makes consoles wider
         self.raw_console.setFixedWidth(700)
@@ -321,194 +412,236 @@ class Window(QWidget):
         self.raw_console.setFixedHeight(200)
 
         # Creater a map to display GPS coordinates
-        self.map = folium.Map(location=[57, 25], zoom_start=8, control_scale=True)
-        folium.LayerControl().add_to(self.map)
-        self.data = io.BytesIO()
-        self.map.save(self.data, close_file=False)
+        # Map page, Leaflet and tiles come from a local server, so map also works without internet
+        self.map_server = MapServer(latitude=57, longitude=25, zoom=8)
         self.mapView = QWebEngineView()
-        self.mapView.setHtml(self.data.getvalue().decode())
-
-        # Creates graph widgets
-        self.temperature_plot = pg.PlotWidget()
-        self.pressure_plot = pg.PlotWidget()
-        self.humidity_plot = pg.PlotWidget()
-        self.altitude_plot = pg.PlotWidget()
-        self.speed_plot = pg.PlotWidget()
-        self.co2_plot = pg.PlotWidget()
-        self.tvoc_plot = pg.PlotWidget()
-        self.no2_plot = pg.PlotWidget()
-        self.pms_plot = pg.PlotWidget()
-
-        # Sets y-axis labels
-        self.temperature_plot.setLabel(axis="left", text="Temperature, Celsius")
-        self.pressure_plot.setLabel(axis="left", text="Pressure, Pa")
-        self.humidity_plot.setLabel(axis="left", text="Humidity, %")
-        self.altitude_plot.setLabel(axis="left", text="Altitude, meters")
-        self.speed_plot.setLabel(axis="left", text="Speed, km/h")
-        self.co2_plot.setLabel(axis="left", text="Co2 concentration, ppm")
-        self.tvoc_plot.setLabel(axis="left", text="TVOC concentration, ug/m^3")
-        self.no2_plot.setLabel(axis="left", text="NO2 concentration, ppm")
-        self.pms_plot.setLabel(axis="left", text="Fine particles, ppm")
-
-        # Changes background of graphs to the same colour as app
-        self.temperature_plot.setBackground(None)
-        self.pressure_plot.setBackground(None)
-        self.humidity_plot.setBackground(None)
-        self.altitude_plot.setBackground(None)
-        self.speed_plot.setBackground(None)
-        self.co2_plot.setBackground(None)
-        self.tvoc_plot.setBackground(None)
-        self.no2_plot.setBackground(None)
-        self.pms_plot.setBackground(None)
-
-        # Adds legends
-        self.co2_plot.addLegend()
-        self.pms_plot.addLegend()
+        # GPS track that is drawn on the map
+        self.track = TrackLayer(self.mapView, MAP_NAME)
+        self.mapView.setUrl(QUrl(self.map_server.url))
 
+        # Creates graph widgets, one for every row of PLOTS in schema.py
         # Changes y-axis colour to black and makes lines wider
         # To change x-axis colour, check attachToPlotItem funtion in DateAxis class
         pen_line = pg.mkPen(color=(0, 0, 0), width=3)
-        self.temperature_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.pressure_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.humidity_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.altitude_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.speed_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.co2_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.tvoc_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.no2_plot.plotItem.getAxis('left').setPen(pen_line)
-        self.pms_plot.plotItem.getAxis('left').setPen(pen_line)
-
-        # Add the Date-time axis to each graph
-        axis1 = DateAxisItem(orientation='bottom')
-        axis1.attachToPlotItem(self.temperature_plot.getPlotItem())
-
-        axis2 = DateAxisItem(orientation='bottom')
-        axis2.attachToPlotItem(self.pressure_plot.getPlotItem())
-
-        axis3 = DateAxisItem(orientation='bottom')
-        axis3.attachToPlotItem(self.humidity_plot.getPlotItem())
-
-        axis4 = DateAxisItem(orientation='bottom')
-        axis4.attachToPlotItem(self.altitude_plot.getPlotItem())
-
-        axis5 = DateAxisItem(orientation='bottom')
-        axis5.attachToPlotItem(self.speed_plot.getPlotItem())
-
-        axis6 = DateAxisItem(orientation='bottom')
-        axis6.attachToPlotItem(self.co2_plot.getPlotItem())
-
-        axis7 = DateAxisItem(orientation='bottom')
-        axis7.attachToPlotItem(self.no2_plot.getPlotItem())
-
-        axis8 = DateAxisItem(orientation='bottom')
-        axis8.attachToPlotItem(self.pms_plot.getPlotItem())
-
-        axis9 = DateAxisItem(orientation='bottom')
-        axis9.attachToPlotItem(self.tvoc_plot.getPlotItem())
+        self.plots = {}
+        for plot in PLOTS:
+            widget = pg.PlotWidget()
+            widget.setLabel(axis="left", text=plot.label)
+            # Changes background of graphs to the same colour as app
+            widget.setBackground(None)
+            widget.plotItem.getAxis('left').setPen(pen_line)
+            # Adds the Date-time axis to graph
+            DateAxisItem(orientation='bottom').attachToPlotItem(widget.getPlotItem())
+            # Adds legend if some line in graph has a name
+            if any(channel.plot == plot.name and channel.legend for channel in FIELDS + DERIVED):
+                widget.addLegend()
+            self.plots[plot.name] = widget
+        # Other graphs are linked to the first one
+        self.main_plot = self.plots[PLOTS[0].name]
 
         # Plots data to graphs
-        self.temp_plot = self.temperature_plot.plot(x=self.timestamps, y=self.data_temp, pen=pg.mkPen('b', width=5))
-
-        self.press_plot = self.pressure_plot.plot(x=self.timestamps, y=self.data_press, pen=pg.mkPen('b', width=5))
-
-        self.humid_plot = self.humidity_plot.plot(x=self.timestamps, y=self.data_humid, pen=pg.mkPen('b', width=5))
-
-        self.alt_plot = self.altitude_plot.plot(x=self.timestamps, y=self.data_alt, pen=pg.mkPen('b', width=5))
-
-        self.spd_plot = self.speed_plot.plot(x=self.timestamps, y=self.data_speed, pen=pg.mkPen('b', width=5))
-
-        self.co2_plot_line = self.co2_plot.plot(x=self.timestamps, y=self.data_co2, name="CO2", pen=pg.mkPen('b', width=5))
-        self.eco2_plot_line = self.co2_plot.plot(x=self.timestamps, y=self.data_eco2, name="eCO2", pen=pg.mkPen('g', width=5))
-
-        self.tvoc_plot_line = self.tvoc_plot.plot(x=self.timestamps, y=self.data_tvoc, pen=pg.mkPen('b', width=5))
-
-        self.no2_plot_line = self.no2_plot.plot(x=self.timestamps, y=self.data_no2, pen=pg.mkPen('b', width=5))
-
-        self.pm10_plot_line = self.pms_plot.plot(x=self.timestamps, y=self.data_pm10, name="PM10", pen=pg.mkPen('b', width=5))
-        self.pm25_plot_line = self.pms_plot.plot(x=self.timestamps, y=self.data_pm25, name="PM25", pen=pg.mkPen('g', width=5))
-        self.pm100_plot_line = self.pms_plot.plot(x=self.timestamps, y=self.data_pm100, name="PM100", pen=pg.mkPen('r', width=5))
+        # Curves that are updated every tick, with channel they show
+        # Every curve also has a thin pen that is used when there are lots of points
+        # Derived channels are drawn last, so averages are on top of values
+        self.curves = []
+        for channel in FIELDS + DERIVED:
+            if channel.plot is None:
+                continue
+            if channel.dashed:
+                pen = pg.mkPen(channel.colour, width=3, style=Qt.DashLine)
+            else:
+                pen = pg.mkPen(channel.colour, width=5)
+            curve = self.plots[channel.plot].plot(x=self.store.timestamps, y=self.store.column(channel.name),
+                                                  name=channel.legend, pen=pen)
+            self.curves.append((curve, channel, pen, pg.mkPen(pen.color(), width=1)))
+        self.thin_curves = set()
+        # Cached min/max/mean values of every channel for every zoom level
+        self.pyramids = {channel.name: SummaryPyramid() for _, channel, _, _ in self.curves}
+
+        # Links x-axis of all graphs, so they can be zoomed together
+        for widget in self.plots.values():
+            if widget is not self.main_plot:
+                widget.setXLink(self.main_plot)
+
+        # Controls for which part of data is shown
+        self.changing_range = False
+        self.follow_live = QtWidgets.QCheckBox("Follow live data")
+        self.follow_live.setChecked(True)
+        self.live_window = QtWidgets.QSpinBox()
+        self.live_window.setRange(1, 24 * 60)
+        self.live_window.setValue(LIVE_WINDOW_MINUTES)
+        self.live_window.setSuffix(" min")
+        self.follow_live.toggled.connect(self.follow_changed)
+        self.live_window.valueChanged.connect(self.follow_changed)
+        self.whole_flight = QtWidgets.QPushButton("Whole flight")
+        self.whole_flight.clicked.connect(self.show_whole_flight)
+        controls = QtWidgets.QHBoxLayout()
+        controls.addWidget(self.follow_live)
+        controls.addWidget(self.live_window)
+        controls.addWidget(self.whole_flight)
+        # Stops consoles from changing, so a packet can be read or copied
+        self.pause_consoles = QtWidgets.QCheckBox("Pause consoles")
+        self.pause_consoles.toggled.connect(self.raw_console.set_paused)
+        self.pause_consoles.toggled.connect(self.displayed_console.set_paused)
+        controls.addWidget(self.pause_consoles)
+        # Zoomed out graphs show mean of every pixel instead of smallest and biggest values
+        self.averages = QtWidgets.QCheckBox("Averages")
+        self.averages.toggled.connect(self.redraw_plots)
+        controls.addWidget(self.averages)
+        # Shows timings and counters of reading, parsing, saving and drawing over graphs
+        self.show_metrics_box = QtWidgets.QCheckBox("Metrics")
+        self.show_metrics_box.toggled.connect(self.show_metrics)
+        controls.addWidget(self.show_metrics_box)
+        controls.addStretch()
+
+        # Overlay is not in grid, it is drawn over the top left corner of window
+        self.metrics_overlay = QtWidgets.QLabel(self)
+        self.metrics_overlay.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.metrics_overlay.setStyleSheet("background-color: rgba(255, 255, 255, 220); padding: 6px;")
+        self.metrics_overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.metrics_overlay.move(10, 10)
+        self.metrics_overlay.hide()
+        self.metrics_previous = None
+        self.metrics_exported = time.monotonic()
+        self.metrics_timer = QTimer()
+        self.metrics_timer.setInterval(1000)  # milliseconds
+        self.metrics_timer.timeout.connect(self.update_metrics)
+        self.metrics_timer.start()
+
+        # Redraws graphs when they are moved or zoomed
+        for widget in self.plots.values():
+            widget.getViewBox().sigRangeChangedManually.connect(self.stop_following)
+        self.main_plot.getViewBox().sigXRangeChanged.connect(self.redraw_plots)
+
+        # Adds graphs to their tabs, every tab has its own grid
+        self.plot_tabs = QtWidgets.QTabWidget()
+        tab_grids = {}
+        for plot in PLOTS:
+            if plot.tab not in tab_grids:
+                tab = QWidget()
+                tab_grids[plot.tab] = QGridLayout(tab)
+                self.plot_tabs.addTab(tab, plot.tab)
+            tab_grids[plot.tab].addWidget(self.plots[plot.name], plot.row, plot.column)
+        # Graphs of a tab that was hidden are drawn when it is shown
+        self.plot_tabs.currentChanged.connect(self.request_frame)
 
         # Adds all widgets to grid
-        grid.addWidget(self.temperature_plot, 0, 0)
-        grid.addWidget(self.pressure_plot, 1, 0)
-        grid.addWidget(self.humidity_plot, 2, 0)
-
-        grid.addWidget(self.speed_plot, 0, 1)
-        grid.addWidget(self.altitude_plot, 1, 1)
-        grid.addWidget(self.co2_plot, 2, 1)
-
-        grid.addWidget(self.tvoc_plot, 0, 2)
-        grid.addWidget(self.no2_plot, 1, 2)
-        grid.addWidget(self.pms_plot, 2, 2)
-
+        grid.addWidget(self.plot_tabs, 0, 0, 3, 3)
         grid.addWidget(self.raw_console, 3, 2)
         grid.addWidget(self.displayed_console, 4, 2)
-        grid.addWidget(self.mapView, 3, 1)
+        grid.addWidget(self.mapView, 3, 1, 2, 1)
+        # Controls take the whole width of window, so they don't make graphs narrower
+        grid.addLayout(controls, 5, 0, 1, 3)
 
         # Shows the ui
         self.show()
 
 
-# Checks if received data doesn't have symbols that it shouldn't have
-# Doesn't account if one number has changed to another one
-# If this check is required, then that has to be set in Cansats and Base station arduino code
-# But then we won't receive data if even one charecter has been corrupted
-# This way we still can receive data, even if not all of it can be used
-def isDataOK():
-    allowed_chars = [",", "."]
-    for char in base_station_data:
-        if not (char.isdigit() or char in allowed_chars):
-            return False
-    return True
-
-
-
-# Connects to serial port and reads data from it
-def serialDataFunction():
-    base_station = None
-    # Opens serial data port
-    base_station = serial.Serial("COM4", 9600)
-    while True:
-        try:
-            # If serial connection has been lost, tries to reconnect back
-            if(base_station == None):
-                base_station = serial.Serial("COM4", 9600)
-                print("Reconnecting")
-            # Reads data from serial port
-            # It blocks function from progressing untill some data has been received
-            base_station_data = str(base_station.readline())
-            # Removes useless data from string
-            base_station_data = base_station_data[2:-6]
-            # If data is not corrupted add data to both data lists
-            if isDataOK():
-                raw_data.append(base_station_data)
-                displayed_data.append(base_station_data)
-            # If some data has been corrupted, doesn't add it to list that
-            # is used to update data to graphs
-            else:
-                raw_data.append(base_station_data)
-
-            with open(file_name, "a", newline="", encoding="UTF8") as csv_f:
-                writer = csv.writer(csv_f)
-                writer.writerow([datetime.now().strftime("%H:%M:%S"), base_station_data])
-        except:
-            # If something goes wrong closes port and tries again
-            if(not(base_station == None)):
-                base_station.close()
-                base_station = None
-                print("Disconnecting")
-
-            print("No Connection")
-            time.sleep(0.25)
+# Adds a received packet to the queue for gui
+# Used for data from serial port and for replayed data
+# source - serial port packet came from, loggers - LoggerPerSource or None
+def receive_packet(received, packet, source=None, loggers=None):
+    global shown_source
+    if loggers is not None:
+        # Logger thread saves data to file, so reading isn't slowed down by writing
+        loggers.log(received, packet, source)
+    if shown_source is None:
+        shown_source = source
+    elif source != shown_source:
+        return
+    # Full queue drops its oldest packet when a new one is added
+    if len(data_queue) == QUEUE_SIZE:
+        METRICS.count("queue.dropped")
+    data_queue.append((received, packet))
+
+
+# Adds a batch from recorder to the queue for gui, if it is from the shown base station
+def receive_batch(batch):
+    global shown_source
+    if shown_source is None:
+        shown_source = batch.source
+    elif batch.source != shown_source:
+        return
+    if len(batch_queue) == QUEUE_SIZE:
+        METRICS.count("queue.dropped_batches")
+    batch_queue.append(batch)
+
+
+# Adds decoded binary frames from serial port to the queue for gui
+# loggers - LoggerPerSource or None
+def receive_frames(batch, loggers=None):
+    if loggers is not None:
+        loggers.log_batch(batch)
+    receive_batch(batch)
+
+
+# Connects to serial ports and reads data from them
+# All ports are read in this thread, and lost connections are opened again
+def serialDataFunction(ports, loggers, stop):
+    run_serial(ports, baudrate, lambda received, packet, port: receive_packet(received, packet, port, loggers), stop,
+               lambda batch: receive_frames(batch, loggers))
 
 
 if __name__ == '__main__':
+    # Without arguments data is read from base station
+    # Recorded or generated data can be used to test the app without base station
+    arg_parser = argparse.ArgumentParser(description="Shows data received from Cansat")
+    arg_parser.add_argument("--replay", metavar="CSV", help="replay a data file saved by the app")
+    arg_parser.add_argument("--synthetic", type=float, metavar="RATE",
+                            help="generate RATE packets per second of a pretend flight")
+    arg_parser.add_argument("--speed", type=float, default=1.0,
+                            help="replay speed, 1 is real time, 10 is 10 times faster, 0 is as fast as possible")
+    arg_parser.add_argument("--attach", nargs="?", type=parse_address, const=RECORDER_ADDRESS, metavar="HOST:PORT",
+                            help="show data from a running recorder.py instead of reading serial port")
+    arg_parser.add_argument("--attach-shm", nargs="?", const=SHM_NAME, metavar="NAME",
+                            help="show data from shared memory of a recorder.py started with --shm")
+    arg_parser.add_argument("--port", action="append", metavar="PORT",
+                            help="serial port of base station, can be given many times, "
+                                 "by default base stations are found automatically")
+    arg_parser.add_argument("--baudrate", type=int, default=baudrate)
+    arg_parser.add_argument("--source", metavar="PORT",
+                            help="base station shown in graphs, by default the first one that sends data")
+    arg_parser.add_argument("--open", metavar="PATH",
+                            help="look at a recorded csv file or folder of .npz chunks after the flight")
+    arg_parser.add_argument("--metrics", metavar="JSON",
+                            help="save timings and counters of reading, parsing, saving and drawing to a json file")
+    args = arg_parser.parse_args()
+    baudrate = args.baudrate
+    shown_source = args.source
+    metrics_file = args.metrics
+
     # Creates a new application process
     app = QtWidgets.QApplication([])
     # Creates the main window
     window = Window()
-    serialThread = threading.Thread(target=serialDataFunction, daemon=True)
-    serialThread.start()
+    loggers = None
+    stop = threading.Event()
+    if args.open:
+        # Recorded session doesn't need a serial thread
+        serialThread = None
+        window.open_session(args.open)
+    elif args.attach_shm:
+        serialThread = threading.Thread(target=follow_shm, args=(receive_batch, args.attach_shm), daemon=True)
+    elif args.attach:
+        # Recorder reads serial port and saves data, app only shows it
+        serialThread = threading.Thread(target=follow_recorder, args=(receive_batch, args.attach), daemon=True)
+    elif args.replay or args.synthetic:
+        # Replayed data is already saved, so it isn't logged again
+        source = read_log(args.replay) if args.replay else synthetic_packets(args.synthetic)
+        serialThread = threading.Thread(target=replay, args=(source, receive_packet, args.speed), daemon=True)
+    else:
+        # Data is saved to file, one file for every base station
+        loggers = LoggerPerSource(file_name, npz=binary_log)
+        ports = args.port or ([com_port] if com_port else [])
+        serialThread = threading.Thread(target=serialDataFunction, args=(ports, loggers, stop), daemon=True)
+    if serialThread is not None:
+        serialThread.start()
     # If app is closed, stop running code
     ret = app.exec_()
+    stop.set()
+    # Writes data that hasn't been saved yet
+    if loggers is not None:
+        loggers.close()
+    if metrics_file:
+        METRICS.export(metrics_file)
     sys.exit()
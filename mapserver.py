@@ -0,0 +1,212 @@
+# Local web server for the map
+# Map page, Leaflet and map tiles are all served from this computer, so the map
+# starts quickly and also works without internet
+# Tiles are saved to a folder the first time they are downloaded, and they can
+# also be downloaded before the flight for the area where Cansat will fly
+#
+# To download tiles before the flight, from a tile server that allows downloading
+# areas in advance (OpenStreetMap's own servers don't):
+#     python mapserver.py --seed 56.5 24.0 58.0 27.0 --zoom 8 14 --url https://tiles.example.com/{z}/{x}/{y}.png
+import argparse
+import math
+import os
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jinja2 import Template
+
+
+# Folder of this file, tiles and Leaflet are looked up from here
+_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STATIC_FOLDER = os.path.join(_FOLDER, "static")
+TILE_FOLDER = os.path.join(_FOLDER, "tiles")
+
+# Where tiles are downloaded from when map needs them and they aren't saved yet
+# Usage policy of this server only allows downloading tiles that are looked at,
+# so it is never used for seeding
+TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+# Tile servers ask apps to say who they are
+USER_AGENT = "DataVisualisation base station"
+
+# JavaScript name of Leaflet map in map page
+MAP_NAME = "map"
+
+# Map page, only Leaflet is loaded
+_MAP_PAGE = Template(
+    """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <link rel="stylesheet" href="/static/leaflet/leaflet.css">
+    <script src="/static/leaflet/leaflet.js"></script>
+    <style>html, body, #map { width: 100%; height: 100%; margin: 0; }</style>
+</head>
+<body>
+    <div id="map"></div>
+    <script>
+        var {{map}} = L.map("map").setView([{{latitude}}, {{longitude}}], {{zoom}});
+        L.control.scale().addTo({{map}});
+        L.tileLayer("/tiles/{z}/{x}/{y}.png", {
+            "maxZoom": 19,
+            "attribution": "&copy; OpenStreetMap contributors"
+        }).addTo({{map}});
+    </script>
+</body>
+</html>
+"""
+)
+
+# Content types of files that are served
+_CONTENT_TYPES = {".js": "application/javascript", ".css": "text/css", ".png": "image/png"}
+
+
+# Number of tile that has the given position at the given zoom
+def tile_number(latitude, longitude, zoom):
+    n = 2 ** zoom
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+# Map tiles saved in folder/z/x/y.png
+class TileCache:
+    # offline - if True, tiles that aren't saved are not downloaded
+    def __init__(self, folder=TILE_FOLDER, url=TILE_URL, offline=False):
+        self.folder = folder
+        self.url = url
+        self.offline = offline
+
+    def path(self, z, x, y):
+        return os.path.join(self.folder, str(z), str(x), f"{y}.png")
+
+    # Returns tile image, or None if it isn't saved and can't be downloaded
+    def get(self, z, x, y):
+        path = self.path(z, x, y)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            pass
+        if self.offline:
+            return None
+        return self.download(z, x, y)
+
+    # Downloads tile and saves it
+    def download(self, z, x, y):
+        request = urllib.request.Request(self.url.format(z=z, x=x, y=y), headers={"User-Agent": USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                data = response.read()
+        except OSError:
+            return None
+        path = self.path(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Writes to a temporary file first, so a half written tile is never used
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+        return data
+
+    # Downloads all tiles of an area for zoom levels min_zoom to max_zoom
+    # Tiles that are already saved are skipped
+    # Public tile servers don't allow downloading huge areas, so max_tiles limits it
+    def seed(self, south, west, north, east, min_zoom, max_zoom, max_tiles=20000):
+        if self.url == TILE_URL:
+            raise ValueError("tile.openstreetmap.org doesn't allow downloading tiles in advance, "
+                             "give a tile server that allows it")
+        tiles = []
+        for z in range(min_zoom, max_zoom + 1):
+            x0, y0 = tile_number(north, west, z)
+            x1, y1 = tile_number(south, east, z)
+            tiles.extend((z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        if len(tiles) > max_tiles:
+            raise ValueError(f"Area has {len(tiles)} tiles, which is more than {max_tiles}")
+        downloaded = failed = 0
+        for z, x, y in tiles:
+            if os.path.exists(self.path(z, x, y)):
+                continue
+            if self.download(z, x, y) is None:
+                failed += 1
+            else:
+                downloaded += 1
+        return downloaded, failed
+
+
+# Answers requests from map view
+class _MapRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/":
+            self._send(self.server.page, "text/html; charset=utf-8")
+        elif path.startswith("/tiles/"):
+            try:
+                z, x, y = path[len("/tiles/"):-len(".png")].split("/")
+                data = self.server.tiles.get(int(z), int(x), int(y))
+            except ValueError:
+                data = None
+            self._send(data, "image/png")
+        elif path.startswith("/static/"):
+            name = os.path.realpath(os.path.join(STATIC_FOLDER, path[len("/static/"):]))
+            data = None
+            # Files outside static folder can't be read
+            if name.startswith(os.path.realpath(STATIC_FOLDER) + os.sep):
+                try:
+                    with open(name, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    pass
+            self._send(data, _CONTENT_TYPES.get(os.path.splitext(name)[1], "application/octet-stream"))
+        else:
+            self._send(None, "")
+
+    def _send(self, data, content_type):
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Doesn't print every request
+    def log_message(self, format, *args):
+        pass
+
+
+# Serves map page on 127.0.0.1 in a background thread
+class MapServer:
+    def __init__(self, latitude=57, longitude=25, zoom=8, tiles=None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _MapRequestHandler)
+        self.server.daemon_threads = True
+        self.server.tiles = tiles or TileCache()
+        self.server.page = _MAP_PAGE.render(map=MAP_NAME, latitude=latitude, longitude=longitude,
+                                            zoom=zoom).encode()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Downloads map tiles for using the map without internet")
+    arg_parser.add_argument("--seed", type=float, nargs=4, required=True, metavar=("SOUTH", "WEST", "NORTH", "EAST"),
+                            help="area to download, in degrees")
+    arg_parser.add_argument("--zoom", type=int, nargs=2, default=[8, 14], metavar=("MIN", "MAX"),
+                            help="zoom levels to download")
+    arg_parser.add_argument("--folder", default=TILE_FOLDER, help="where tiles are saved")
+    arg_parser.add_argument("--url", required=True,
+                            help="tile server that allows downloading areas in advance, with {z}, {x} and {y} in it")
+    args = arg_parser.parse_args()
+
+    cache = TileCache(args.folder, args.url)
+    downloaded, failed = cache.seed(*args.seed, *args.zoom)
+    print(f"Downloaded {downloaded} tiles, {failed} failed")
@@ -0,0 +1,200 @@
+# GPS track on the Leaflet map
+# Whole track is one polyline that is extended in place, and only the latest
+# position has a marker. New points are sent to the map once per tick in one
+# JavaScript call, and long tracks are simplified so the browser doesn't slow down
+import json
+import math
+import time
+
+import numpy
+from jinja2 import Template
+from PyQt5.QtCore import QTimer
+
+
+# Creates track and marker the first time, then replaces track points and moves marker
+# Templates are compiled only once, when the module is loaded
+_TRACK_JS = Template(
+    """
+(function() {
+    var map = {{map}};
+    if (!window.telemetryTrack) {
+        window.telemetryTrack = L.polyline([], {
+            "color": "#3388ff",
+            "opacity": 1.0,
+            "weight": 3,
+            "lineCap": "round",
+            "lineJoin": "round"
+        }).addTo(map);
+        window.telemetryMarker = L.circleMarker([0, 0], {
+            "color": "#ff3333",
+            "fill": true,
+            "fillOpacity": 0.8,
+            "radius": 6,
+            "weight": 2
+        });
+    }
+    var points = {{points}};
+    {% if replace %}
+    window.telemetryTrack.setLatLngs(points);
+    {% else %}
+    window.telemetryTrack.setLatLngs(window.telemetryTrack.getLatLngs().concat(points));
+    {% endif %}
+    var last = points[points.length - 1];
+    window.telemetryMarker.setLatLng(last);
+    if (!map.hasLayer(window.telemetryMarker)) {
+        window.telemetryMarker.addTo(map);
+    }
+})();
+"""
+)
+
+
+# Radius of Earth in meters, used to change degrees to meters
+_EARTH_RADIUS = 6371000.0
+# Track is simplified when it has more points than this
+MAX_TRACK_POINTS = 2000
+# How many meters simplified track can be away from real one at first
+TRACK_TOLERANCE = 2.0
+
+
+# Douglas-Peucker line simplification
+# Returns indexes of points that have to be kept, so that no removed point is
+# further than tolerance meters from the simplified line
+def simplify(latitudes, longitudes, tolerance):
+    count = len(latitudes)
+    if count < 3:
+        return numpy.arange(count)
+    # Changes coordinates to meters, good enough for the small area of one flight
+    lat0 = math.radians(float(numpy.mean(latitudes)))
+    y = numpy.radians(latitudes) * _EARTH_RADIUS
+    x = numpy.radians(longitudes) * _EARTH_RADIUS * math.cos(lat0)
+
+    keep = numpy.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    # Sections that still have to be checked, as (first, last) index
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        length = math.hypot(dx, dy)
+        # Distance of every point in section from line between first and last point
+        if length == 0:
+            distances = numpy.hypot(px, py)
+        else:
+            distances = numpy.abs(dx * py - dy * px) / length
+        i = int(numpy.argmax(distances))
+        if distances[i] > tolerance:
+            middle = first + 1 + i
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return numpy.flatnonzero(keep)
+
+
+# Positions that have GPS signal, positions that are 0 or NaN are left out
+def acquired_points(latitudes, longitudes):
+    latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+    longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+    acquired = numpy.isfinite(latitudes) & numpy.isfinite(longitudes) & (numpy.trunc(latitudes) != 0)
+    return latitudes[acquired], longitudes[acquired]
+
+
+# Simplifies track if it has more than max_points points
+# Tolerance is made bigger until track has at most half of max_points, and every
+# try simplifies the result of the one before, so a long track is only gone through once
+def simplify_track(latitudes, longitudes, max_points=MAX_TRACK_POINTS, tolerance=TRACK_TOLERANCE):
+    if len(latitudes) <= max_points:
+        return latitudes, longitudes
+    while True:
+        keep = simplify(latitudes, longitudes, tolerance)
+        latitudes = latitudes[keep]
+        longitudes = longitudes[keep]
+        if len(keep) <= max_points // 2:
+            return latitudes, longitudes
+        tolerance *= 2
+
+
+class TrackLayer:
+    # view - QWebEngineView that shows the map
+    # map_name - JavaScript name of Leaflet map in the page
+    # max_points - track is simplified when it has more points than this
+    # tolerance - how many meters simplified track can be away from real one
+    # min_interval - seconds between sending points to map
+    def __init__(self, view, map_name, max_points=MAX_TRACK_POINTS, tolerance=TRACK_TOLERANCE, min_interval=1.0):
+        self.view = view
+        self.map_name = map_name
+        self.max_points = max_points
+        self.tolerance = tolerance
+        self.min_interval = min_interval
+        # Points that are shown on map, after simplification
+        self.latitudes = numpy.empty(0)
+        self.longitudes = numpy.empty(0)
+        # Points that haven't been sent to map yet
+        self.pending = []
+        self.last_flush = 0.0
+        # Sends points that were held back by min_interval, so last positions are
+        # shown even if no more data arrives, like after landing
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        # JavaScript can only be run after map page has loaded
+        self.loaded = False
+        view.loadFinished.connect(self._page_loaded)
+
+    def _page_loaded(self, ok):
+        self.loaded = ok
+        if ok:
+            # Page has been loaded again, so whole track has to be sent
+            self.flush(force=True, replace=True)
+
+    # Adds new GPS positions, positions without GPS signal (0 or NaN) are skipped
+    def add_points(self, latitudes, longitudes):
+        latitudes, longitudes = acquired_points(latitudes, longitudes)
+        if len(latitudes):
+            self.pending.append((latitudes, longitudes))
+
+    # Replaces whole track, like when a recorded session is opened
+    # Points should already be simplified, for example by simplify_track
+    # They are shown on map by flush(force=True, replace=True)
+    def set_points(self, latitudes, longitudes):
+        self.pending = []
+        self.latitudes, self.longitudes = simplify_track(numpy.asarray(latitudes, dtype=numpy.float64),
+                                                         numpy.asarray(longitudes, dtype=numpy.float64),
+                                                         self.max_points, self.tolerance)
+
+    # Sends new points to map in one JavaScript call
+    # If last call was less than min_interval seconds ago, points are sent when
+    # min_interval has passed, unless force is set
+    def flush(self, force=False, replace=False):
+        now = time.monotonic()
+        if not self.loaded:
+            return
+        if not force and now - self.last_flush < self.min_interval:
+            if self.pending and not self._timer.isActive():
+                self._timer.start(int((self.min_interval - (now - self.last_flush)) * 1000) + 1)
+            return
+        if self.pending:
+            new_lat = numpy.concatenate([lat for lat, _ in self.pending])
+            new_lon = numpy.concatenate([lon for _, lon in self.pending])
+            self.pending = []
+            self.latitudes = numpy.concatenate((self.latitudes, new_lat))
+            self.longitudes = numpy.concatenate((self.longitudes, new_lon))
+            # Track is simplified when it gets too long
+            if len(self.latitudes) > self.max_points:
+                self.latitudes, self.longitudes = simplify_track(self.latitudes, self.longitudes,
+                                                                 self.max_points, self.tolerance)
+                replace = True
+            points = numpy.column_stack((self.latitudes, self.longitudes)) if replace else \
+                numpy.column_stack((new_lat, new_lon))
+        elif replace and len(self.latitudes):
+            points = numpy.column_stack((self.latitudes, self.longitudes))
+        else:
+            return
+        self.last_flush = now
+        js = _TRACK_JS.render(map=self.map_name, points=json.dumps(points.tolist()), replace=replace)
+        self.view.page().runJavaScript(js)
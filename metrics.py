@@ -0,0 +1,167 @@
+# Counters, gauges and timers for finding out where time goes
+# Serial reading, parsing, logging and drawing all add to the same METRICS object,
+# which can be shown in the app with "Metrics" checkbox and saved to a json file:
+#     python main.py --metrics metrics.json
+# Recording a value only takes a lock and a few additions, so it can be used
+# for every packet and every curve without slowing the app down
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy
+
+
+# Upper edges of histogram buckets in seconds, 4 buckets for every power of 10
+# from 1 microsecond to 100 seconds. Values above the last edge go to an extra bucket
+BUCKETS = numpy.logspace(-6, 2, 33).tolist()
+
+
+# Distribution of values, like how long parsing took
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    # Adds many values at once, values is a NumPy array
+    def observe_many(self, values):
+        values = values[numpy.isfinite(values)]
+        if len(values) == 0:
+            return
+        counts = numpy.bincount(numpy.searchsorted(BUCKETS, values, side="left"), minlength=len(self.counts))
+        self.counts = (numpy.array(self.counts) + counts).tolist()
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    # Value that q of values are smaller than, as upper edge of bucket it is in
+    def percentile(self, q):
+        if self.count == 0:
+            return float("nan")
+        needed = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= needed:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            # Only buckets that have values, as [upper edge, count]
+            "buckets": [[BUCKETS[i] if i < len(BUCKETS) else None, count]
+                        for i, count in enumerate(self.counts) if count],
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # Things that only go up, like number of corrupted packets
+            self.counters = {}
+            # Latest value of things that go up and down, like queue length
+            self.gauges = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def _histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def observe(self, name, value):
+        with self.lock:
+            self._histogram(name).observe(value)
+
+    def observe_many(self, name, values):
+        with self.lock:
+            self._histogram(name).observe_many(numpy.asarray(values, dtype=numpy.float64))
+
+    # Measures how long code inside with block takes:
+    #     with METRICS.timer("parse"):
+    #         ...
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    # All values as a dictionary that can be saved as json
+    def snapshot(self):
+        with self.lock:
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timers": {name: histogram.summary() for name, histogram in self.histograms.items()},
+            }
+
+    # Saves snapshot to a json file
+    # Writes to a temporary file first, so file is never half written
+    def export(self, path):
+        with open(path + ".part", "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(path + ".part", path)
+
+    # Short text of all values, one line for every value
+    # previous is an earlier snapshot, if it is given counters also show how much
+    # they grew per second since then
+    def format_lines(self, previous=None):
+        snapshot = self.snapshot()
+        lines = []
+        elapsed = snapshot["time"] - previous["time"] if previous else 0
+        for name, value in sorted(snapshot["counters"].items()):
+            line = f"{name:24} {value:>10}"
+            if elapsed > 0:
+                line += f" {(value - previous['counters'].get(name, 0)) / elapsed:>9.1f}/s"
+            lines.append(line)
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"{name:24} {value:>10.4g}")
+        for name, timer in sorted(snapshot["timers"].items()):
+            if timer["count"]:
+                lines.append(f"{name:24} {timer['count']:>10} mean {timer['mean'] * 1000:8.2f} ms"
+                             f"  p90 {timer['p90'] * 1000:8.2f} ms  max {timer['max'] * 1000:8.2f} ms")
+        return lines
+
+
+# Metrics of the whole program
+METRICS = Metrics()
@@ -0,0 +1,122 @@
+# Checks and parses packets received from base station
+# A packet is numbers separated by commas, in the order of FIELDS in schema.py
+# Whole batches of packets are converted to numbers at once by NumPy, which is much
+# faster than converting every data unit with float()
+import re
+import warnings
+from collections import namedtuple
+
+import numpy
+
+from metrics import METRICS
+from schema import FIELDS
+
+
+# How many data units there are in a packet
+FIELD_COUNT = len(FIELDS)
+
+# One data unit, a number with optional minus sign and decimal point
+_NUMBER = r"-?(?:\d+\.?\d*|\.\d+)"
+FIELD_RE = re.compile(_NUMBER)
+# Whole packet that isn't corrupted
+PACKET_RE = re.compile(_NUMBER + r"(?:," + _NUMBER + r"){" + str(FIELD_COUNT - 1) + r"}")
+# Only symbols that can be in a packet, used to quickly find packets that are surely corrupted
+_ALLOWED_RE = re.compile(r"[0-9.,\-]*")
+
+# Result of parsing a batch of packets
+# values - one row of FIELD_COUNT data units per packet, corrupted data units are NaN
+# valid - same shape as values, True for data units that could be read
+# ok - True for packets where all data units could be read
+ParsedPackets = namedtuple("ParsedPackets", ["values", "valid", "ok"])
+
+
+# Checks if whole packet has correct data units
+# Doesn't account if one number has changed to another one
+# If this check is required, then that has to be set in Cansats and Base station arduino code
+def is_packet_ok(packet):
+    return PACKET_RE.fullmatch(packet) is not None
+
+
+# Parses one packet, data units that can't be read are NaN
+# Returns values, valid and ok like parse_packets, but for one packet
+def parse_packet(packet):
+    values = numpy.full(FIELD_COUNT, numpy.nan)
+    valid = numpy.zeros(FIELD_COUNT, dtype=bool)
+    fields = packet.split(",")
+    # If some data units are missing it isn't known which ones, so nothing can be used
+    if len(fields) != FIELD_COUNT:
+        return values, valid, False
+    for i, field in enumerate(fields):
+        if FIELD_RE.fullmatch(field):
+            values[i] = float(field)
+            valid[i] = True
+    return values, valid, bool(valid.all())
+
+
+# Converts packets that look correct to numbers in one NumPy call
+# If some of them can't be converted after all, batch is split in half until
+# the bad packets are found, and they are added to failed list
+def _bulk_convert(packets, rows, values, valid, failed):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            converted = numpy.loadtxt([packets[i] for i in rows], delimiter=",", dtype=numpy.float64, ndmin=2)
+    except ValueError:
+        converted = None
+    if converted is not None and converted.shape == (len(rows), FIELD_COUNT):
+        values[rows] = converted
+        valid[rows] = True
+    elif len(rows) == 1:
+        failed.append(rows[0])
+    else:
+        middle = len(rows) // 2
+        _bulk_convert(packets, rows[:middle], values, valid, failed)
+        _bulk_convert(packets, rows[middle:], values, valid, failed)
+
+
+# Parses a list of packets
+# Packets that aren't corrupted are converted together, and only corrupted
+# ones are checked one data unit at a time, so their good data units can still be used
+def parse_packets(packets):
+    count = len(packets)
+    values = numpy.full((count, FIELD_COUNT), numpy.nan)
+    valid = numpy.zeros((count, FIELD_COUNT), dtype=bool)
+
+    # Quick check that only looks at symbols and number of data units
+    # Empty data units, like in rows of log files, are also found here, because
+    # a batch with them can't be converted at once
+    allowed = _ALLOWED_RE.fullmatch
+    good = []
+    failed = []
+    for i, packet in enumerate(packets):
+        if packet.count(",") == FIELD_COUNT - 1 and allowed(packet) is not None and ",," not in packet \
+                and packet[:1] != "," and packet[-1:] != ",":
+            good.append(i)
+        else:
+            failed.append(i)
+
+    if good:
+        _bulk_convert(packets, good, values, valid, failed)
+    for i in failed:
+        values[i], valid[i], _ = parse_packet(packets[i])
+    return ParsedPackets(values, valid, valid.all(axis=1))
+
+
+# Parsed packets together with when they were received
+# This is what recorder sends to viewers
+# timestamps - time every packet was received
+# packets - packets as they were received, for consoles
+# values, valid, ok - same as in ParsedPackets
+# source - serial port of base station that received the packets, or None
+PacketBatch = namedtuple("PacketBatch", ["timestamps", "packets", "values", "valid", "ok", "source"],
+                         defaults=[None])
+
+
+# Parses packets and returns them as a PacketBatch
+def parse_batch(timestamps, packets, source=None):
+    with METRICS.timer("parse"):
+        parsed = parse_packets(packets)
+    METRICS.count("packets.parsed", len(packets))
+    METRICS.count("packets.corrupt", len(packets) - int(numpy.count_nonzero(parsed.ok)))
+    return PacketBatch(numpy.asarray(timestamps, dtype=numpy.float64), list(packets),
+                       parsed.values, parsed.valid, parsed.ok, source)
@@ -0,0 +1,321 @@
+# Headless recorder
+# Reads base station, saves data to file and sends parsed data to viewers
+# It doesn't need a display, and it keeps recording if the app is closed or freezes
+# Any number of apps can attach to it as viewers:
+#     python recorder.py
+#     python main.py --attach
+# Without --port base stations are found automatically, and if there are many,
+# all of them are recorded and viewers show the first one
+# Parsed samples can also be shared through shared memory, which is faster
+# for high data rates, but then viewers don't get raw packets:
+#     python recorder.py --port COM4 --shm
+#     python main.py --attach-shm
+import argparse
+import ipaddress
+import queue
+import random
+import struct
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy
+
+from logger import LoggerPerSource
+from metrics import METRICS
+from packets import FIELD_COUNT, PacketBatch, parse_batch
+from replay import replay, synthetic_packets
+from serialport import run_serial
+from shmring import SHM_NAME, ShmRingWriter
+
+
+# Address where recorder waits for viewers
+# Only programs on this computer can connect to it, other addresses are not allowed
+RECORDER_ADDRESS = ("127.0.0.1", 47800)
+# Viewers have to know this to connect, so other programs can't send data to them
+# It is in public source, so it only keeps out programs that connect by mistake.
+# That is why batches are sent as plain numbers and text, never as pickles
+AUTHKEY = b"cansat base station"
+
+# Start of every batch sent to viewers:
+#     magic, samples, data units per sample, bytes of source, bytes of packets
+# Then timestamps (float64), values (float64, one row per sample), valid (bool,
+# same shape), ok (bool), source and packets separated by newlines, as UTF-8
+# Batches of binary frames have no packets, then bytes of packets is 0
+_BATCH_HEADER = struct.Struct("<4sIIII")
+_BATCH_MAGIC = b"CSB1"
+# Biggest batch a viewer accepts, in bytes
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+# How often received packets are parsed and sent to viewers, in seconds
+PUBLISH_INTERVAL = 0.1
+# How many batches can wait for a slow viewer before the oldest ones are dropped
+VIEWER_QUEUE_SIZE = 100
+# How often metrics are saved when recorder is started with --metrics, in seconds
+METRICS_INTERVAL = 10.0
+
+
+# Sends batches to one viewer from its own thread, so a slow viewer doesn't slow down others
+class _Viewer:
+    def __init__(self, connection, on_close):
+        self.connection = connection
+        self.on_close = on_close
+        self.batches = queue.Queue(maxsize=VIEWER_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # batch is bytes made by encode_batch, or None to close connection
+    def send(self, batch):
+        try:
+            self.batches.put_nowait(batch)
+        except queue.Full:
+            # Oldest batch is dropped so viewer gets the latest data
+            try:
+                self.batches.get_nowait()
+                METRICS.count("viewer.dropped_batches")
+            except queue.Empty:
+                pass
+            self.batches.put_nowait(batch)
+
+    def close(self):
+        self.send(None)
+
+    def _run(self):
+        try:
+            while True:
+                batch = self.batches.get()
+                if batch is None:
+                    break
+                self.connection.send_bytes(batch)
+        except (OSError, EOFError):
+            pass
+        self.connection.close()
+        self.on_close(self)
+
+
+class Recorder:
+    # address - where viewers can connect
+    # loggers - LoggerPerSource that saves data, or None
+    # ring - ShmRingWriter where parsed samples are also written, or None
+    #        Ring has room for one base station, so only the first one is written to it
+    def __init__(self, address=RECORDER_ADDRESS, loggers=None, ring=None):
+        self.loggers = loggers
+        self.ring = ring
+        self.ring_source = None
+        self.listener = Listener(address, authkey=AUTHKEY)
+        self.viewers = []
+        self.lock = threading.Lock()
+        # Packets that haven't been sent to viewers yet, as
+        # {source: (timestamps, packets)}
+        self.pending = {}
+        # Batches of binary frames that haven't been sent yet, as {source: [PacketBatch]}
+        self.pending_frames = {}
+        self.stop = threading.Event()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    # Called for every packet from serial port
+    def receive(self, received, packet, source=None):
+        with self.lock:
+            timestamps, packets = self.pending.setdefault(source, ([], []))
+            timestamps.append(received)
+            packets.append(packet)
+        if self.loggers is not None:
+            self.loggers.log(received, packet, source)
+
+    # Called for decoded binary frames from serial port
+    def receive_frames(self, batch):
+        with self.lock:
+            self.pending_frames.setdefault(batch.source, []).append(batch)
+        if self.loggers is not None:
+            self.loggers.log_batch(batch)
+
+    # Waits for new viewers
+    def _accept(self):
+        while not self.stop.is_set():
+            try:
+                connection = self.listener.accept()
+            except (OSError, AuthenticationError):
+                # Listener has been closed or viewer had wrong authkey
+                if self.stop.is_set():
+                    return
+                continue
+            with self.lock:
+                self.viewers.append(_Viewer(connection, self._remove_viewer))
+            print("Viewer attached,", len(self.viewers), "viewers")
+
+    def _remove_viewer(self, viewer):
+        with self.lock:
+            if viewer in self.viewers:
+                self.viewers.remove(viewer)
+        print("Viewer detached,", len(self.viewers), "viewers")
+
+    # Parses packets received since last time and sends them to all viewers
+    # Every base station gets its own batch, and binary frames are sent in a batch
+    # of their own that has no packets
+    def publish(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            pending_frames, self.pending_frames = self.pending_frames, {}
+            viewers = list(self.viewers)
+        batches = [parse_batch(timestamps, packets, source) for source, (timestamps, packets) in pending.items()]
+        for source, frames in pending_frames.items():
+            batches.append(PacketBatch(numpy.concatenate([b.timestamps for b in frames]), [],
+                                       numpy.concatenate([b.values for b in frames]),
+                                       numpy.concatenate([b.valid for b in frames]),
+                                       numpy.concatenate([b.ok for b in frames]), source))
+        METRICS.gauge("recorder.pending", sum(len(batch.timestamps) for batch in batches))
+        for batch in batches:
+            source = batch.source
+            if viewers:
+                data = encode_batch(batch)
+                for viewer in viewers:
+                    viewer.send(data)
+            if self.ring is not None:
+                if self.ring_source is None:
+                    self.ring_source = source
+                if source == self.ring_source:
+                    # Packets where nothing could be read are not added
+                    usable = batch.valid.any(axis=1)
+                    self.ring.write(batch.timestamps[usable], batch.values[usable])
+
+    # Publishes every PUBLISH_INTERVAL seconds until stopped
+    # If metrics_file is given, metrics are saved to it every METRICS_INTERVAL seconds
+    def run(self, metrics_file=None):
+        last_export = time.monotonic()
+        while not self.stop.is_set():
+            time.sleep(PUBLISH_INTERVAL)
+            with METRICS.timer("recorder.publish"):
+                self.publish()
+            if metrics_file and time.monotonic() - last_export >= METRICS_INTERVAL:
+                METRICS.export(metrics_file)
+                last_export = time.monotonic()
+
+    def close(self):
+        self.stop.set()
+        self.listener.close()
+        with self.lock:
+            for viewer in self.viewers:
+                viewer.close()
+
+
+# Makes bytes of a PacketBatch for sending to viewers
+def encode_batch(batch):
+    count = len(batch.timestamps)
+    source = b"" if batch.source is None else str(batch.source).encode("utf-8")
+    packets = "\n".join(batch.packets).encode("utf-8")
+    return b"".join((_BATCH_HEADER.pack(_BATCH_MAGIC, count, FIELD_COUNT, len(source), len(packets)),
+                     numpy.ascontiguousarray(batch.timestamps, dtype="<f8").tobytes(),
+                     numpy.ascontiguousarray(batch.values, dtype="<f8").tobytes(),
+                     numpy.ascontiguousarray(batch.valid, dtype=bool).tobytes(),
+                     numpy.ascontiguousarray(batch.ok, dtype=bool).tobytes(),
+                     source, packets))
+
+
+# Reads bytes made by encode_batch, raises ValueError if they aren't a batch
+def decode_batch(data):
+    if len(data) < _BATCH_HEADER.size:
+        raise ValueError("Batch is too short")
+    magic, count, fields, source_size, packets_size = _BATCH_HEADER.unpack_from(data)
+    if magic != _BATCH_MAGIC or fields != FIELD_COUNT:
+        raise ValueError("Not a batch of this version")
+    sizes = [count * 8, count * fields * 8, count * fields, count, source_size, packets_size]
+    if _BATCH_HEADER.size + sum(sizes) != len(data):
+        raise ValueError("Batch has wrong length")
+    parts = []
+    offset = _BATCH_HEADER.size
+    for size in sizes:
+        parts.append(data[offset:offset + size])
+        offset += size
+    timestamps = numpy.frombuffer(parts[0], dtype="<f8")
+    values = numpy.frombuffer(parts[1], dtype="<f8").reshape(count, fields)
+    valid = numpy.frombuffer(parts[2], dtype=bool).reshape(count, fields)
+    ok = numpy.frombuffer(parts[3], dtype=bool)
+    source = parts[4].decode("utf-8") if source_size else None
+    packets = parts[5].decode("utf-8").split("\n") if packets_size else []
+    if packets and len(packets) != count:
+        raise ValueError("Batch has wrong number of packets")
+    return PacketBatch(timestamps, packets, values, valid, ok, source)
+
+
+# Connects to recorder and calls receive(batch) for every PacketBatch it sends
+# If recorder isn't running or stops, tries to connect again
+# Used by app when it is started with --attach
+def follow_recorder(receive, address=RECORDER_ADDRESS, stop=None):
+    delay = 0.25
+    while stop is None or not stop.is_set():
+        try:
+            connection = Client(address, authkey=AUTHKEY)
+        except (OSError, AuthenticationError):
+            time.sleep(delay)
+            # Waits longer every time, up to 5 seconds
+            delay = min(delay * 2, 5.0)
+            continue
+        print("Attached to recorder")
+        delay = 0.25
+        try:
+            while stop is None or not stop.is_set():
+                receive(decode_batch(connection.recv_bytes(MAX_BATCH_BYTES)))
+        except (OSError, EOFError, ValueError) as e:
+            print("Recorder disconnected", e)
+        connection.close()
+
+
+# Parses "host:port" to an address
+# Only addresses of this computer are allowed, recorder must not be reachable from network
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    host = host.strip("[]") or RECORDER_ADDRESS[0]
+    if host != "localhost":
+        try:
+            loopback = ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            loopback = False
+        if not loopback:
+            raise argparse.ArgumentTypeError(f"{host} is not an address of this computer, use 127.0.0.1")
+    return host, int(port)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Records data from base station without the app")
+    arg_parser.add_argument("--port", action="append", metavar="PORT",
+                            help="serial port of base station, can be given many times, "
+                                 "by default base stations are found automatically")
+    arg_parser.add_argument("--baudrate", type=int, default=9600)
+    arg_parser.add_argument("--listen", type=parse_address, default=RECORDER_ADDRESS, metavar="HOST:PORT",
+                            help="where viewers can connect")
+    arg_parser.add_argument("--file", help="csv file where data is saved, by default a new dataNNNN.csv")
+    arg_parser.add_argument("--npz", action="store_true", help="also save data as .npz chunks")
+    arg_parser.add_argument("--shm", nargs="?", const=SHM_NAME, metavar="NAME",
+                            help="also write parsed samples to a shared memory ring buffer")
+    arg_parser.add_argument("--synthetic", type=float, metavar="RATE",
+                            help="generate RATE packets per second instead of reading serial port, for testing")
+    arg_parser.add_argument("--metrics", metavar="JSON",
+                            help="save timings and counters of reading, parsing and saving to a json file")
+    args = arg_parser.parse_args()
+
+    file_name = args.file or f"data{random.randint(1000, 10000)}.csv"
+    loggers = None
+    if not args.synthetic:
+        loggers = LoggerPerSource(file_name, npz=args.npz)
+    ring = ShmRingWriter(args.shm) if args.shm else None
+    recorder = Recorder(args.listen, loggers, ring)
+    if args.synthetic:
+        source = threading.Thread(target=replay, args=(synthetic_packets(args.synthetic), recorder.receive, 1.0,
+                                                      recorder.stop), daemon=True)
+    else:
+        source = threading.Thread(target=run_serial, args=(args.port or [], args.baudrate, recorder.receive,
+                                                          recorder.stop, recorder.receive_frames), daemon=True)
+    source.start()
+    print("Waiting for viewers on", f"{args.listen[0]}:{args.listen[1]}")
+    try:
+        recorder.run(args.metrics)
+    except KeyboardInterrupt:
+        pass
+    recorder.close()
+    if ring is not None:
+        ring.close()
+    if loggers is not None:
+        loggers.close()
+    if args.metrics:
+        METRICS.export(args.metrics)
@@ -0,0 +1,190 @@
+# Helpers that keep graphs fast when a lot of data has been received
+# Instead of drawing every sample, graphs only draw as many points as there are
+# pixels, and the smallest and biggest value of every pixel is kept so peaks don't disappear
+import numpy
+
+
+# Growable float64 array, same doubling idea as in TelemetryStore
+class _GrowArray:
+    def __init__(self, capacity=64):
+        self._data = numpy.empty(capacity)
+        self.size = 0
+
+    def extend(self, values):
+        count = len(values)
+        if self.size + count > len(self._data):
+            capacity = max(len(self._data), 64)
+            while capacity < self.size + count:
+                capacity *= 2
+            data = numpy.empty(capacity)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size:self.size + count] = values
+        self.size += count
+
+    # Uses values without copying, they are copied only when something is added
+    # so values can also be a read-only memory-mapped array
+    @classmethod
+    def wrap(cls, values):
+        array = cls(0)
+        array._data = values
+        array.size = len(values)
+        return array
+
+    @property
+    def values(self):
+        return self._data[:self.size]
+
+
+# Min/max decimation of one channel, cached for every zoom level
+# Level k holds min and max of bins that are 2**(k+1) samples wide
+# Bins that are full never change, so new samples only add bins to the end
+# of every level and nothing has to be computed again for old data
+class MinMaxPyramid:
+    def __init__(self):
+        self.levels = []
+
+    # Bin width in samples of a level
+    @staticmethod
+    def bin_size(level):
+        return 2 ** (level + 1)
+
+    # Adds bins for samples that have been appended to y since last update
+    # y is the whole channel, not only new samples
+    def update(self, y):
+        lower_min = lower_max = y
+        for level in range(64):
+            if level == len(self.levels):
+                if len(lower_min) < 2:
+                    break
+                self.levels.append((_GrowArray(), _GrowArray()))
+            mins, maxs = self.levels[level]
+            # Takes pairs of lower level values that haven't been made into bins yet
+            start = mins.size * 2
+            stop = (len(lower_min) // 2) * 2
+            if stop > start:
+                # fmin and fmax ignore NaN, so a missing value doesn't hide the whole bin
+                mins.extend(numpy.fmin(lower_min[start:stop:2], lower_min[start + 1:stop:2]))
+                maxs.extend(numpy.fmax(lower_max[start:stop:2], lower_max[start + 1:stop:2]))
+            lower_min = mins.values
+            lower_max = maxs.values
+
+    def clear(self):
+        self.levels = []
+
+
+# Min/max pyramid that also keeps the mean of every bin
+# Sums and counts of values that aren't NaN are kept instead of means, so bins
+# can be combined exactly and new samples are added the same way as min and max
+class SummaryPyramid(MinMaxPyramid):
+    def __init__(self):
+        super().__init__()
+        self.sums = []
+
+    def update(self, y):
+        super().update(y)
+        # Only samples that aren't in bins of the first level yet are looked at,
+        # offset is index of the first of them in y
+        offset = self.sums[0][0].size * 2 if self.sums else 0
+        finite = numpy.isfinite(y[offset:])
+        lower_sum = numpy.where(finite, y[offset:], 0.0)
+        lower_count = finite.astype(numpy.float64)
+        for level in range(len(self.levels)):
+            if level == len(self.sums):
+                self.sums.append((_GrowArray(), _GrowArray()))
+            sums, counts = self.sums[level]
+            start = sums.size * 2 - offset
+            stop = ((offset + len(lower_sum)) // 2) * 2 - offset
+            if stop > start:
+                sums.extend(lower_sum[start:stop:2] + lower_sum[start + 1:stop:2])
+                counts.extend(lower_count[start:stop:2] + lower_count[start + 1:stop:2])
+            lower_sum = sums.values
+            lower_count = counts.values
+            offset = 0
+
+    # Mean of bins start to stop of a level, NaN for bins that have no values
+    # Only the bins that are asked for are divided, so a small view of a long flight is fast
+    def means(self, level, start=0, stop=None):
+        sums, counts = self.sums[level]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return sums.values[start:stop] / counts.values[start:stop]
+
+    def clear(self):
+        super().clear()
+        self.sums = []
+
+    # Arrays for saving the pyramid with numpy.savez
+    # Levels are joined to one array of every kind, so there are only a few arrays to save
+    def to_arrays(self):
+        return {
+            "sizes": numpy.array([mins.size for mins, _ in self.levels], dtype=numpy.int64),
+            "min": _join([mins for mins, _ in self.levels]),
+            "max": _join([maxs for _, maxs in self.levels]),
+            "sum": _join([sums for sums, _ in self.sums]),
+            "count": _join([counts for _, counts in self.sums]),
+        }
+
+    # Makes pyramid from arrays returned by to_arrays
+    @classmethod
+    def from_arrays(cls, arrays):
+        pyramid = cls()
+        sizes = arrays["sizes"]
+        kinds = [numpy.split(arrays[name], numpy.cumsum(sizes)[:-1]) for name in ("min", "max", "sum", "count")]
+        for mins, maxs, sums, counts in zip(*kinds):
+            grows = [_GrowArray.wrap(values) for values in (mins, maxs, sums, counts)]
+            pyramid.levels.append((grows[0], grows[1]))
+            pyramid.sums.append((grows[2], grows[3]))
+        return pyramid
+
+
+def _join(arrays):
+    return numpy.concatenate([array.values for array in arrays]) if arrays else numpy.empty(0)
+
+
+# Returns points that should be drawn for samples between x0 and x1 when
+# graph is width pixels wide
+# Every bin is drawn as its min and max at the time of the first sample in bin
+# If mean is True and pyramid is a SummaryPyramid, every bin is drawn as its mean instead
+def decimate(t, y, pyramid, x0, x1, width, mean=False):
+    # One sample outside the view on both sides, so line goes to the edge of graph
+    i0 = max(int(numpy.searchsorted(t, x0, side="left")) - 1, 0)
+    i1 = min(int(numpy.searchsorted(t, x1, side="right")) + 1, len(t))
+    width = max(int(width), 1)
+
+    # If there are less samples than pixels, everything can be drawn
+    if i1 - i0 <= 2 * width or not pyramid.levels:
+        return t[i0:i1], y[i0:i1]
+
+    # Finds the first level that has at most one bin per pixel
+    level = 0
+    while (i1 - i0) / MinMaxPyramid.bin_size(level) > width and level + 1 < len(pyramid.levels):
+        level += 1
+
+    x = []
+    values = []
+    start = (i0 // MinMaxPyramid.bin_size(level)) * MinMaxPyramid.bin_size(level)
+    # Full bins are taken from chosen level, and the part after last full bin
+    # is taken from lower levels, so the end of the line is never left undecimated
+    while level >= 0 and start < i1:
+        size = MinMaxPyramid.bin_size(level)
+        mins, maxs = pyramid.levels[level]
+        j0 = start // size
+        j1 = min(-(-i1 // size), mins.size)
+        if j1 > j0 and mean:
+            x.append(t[j0 * size:j1 * size:size])
+            values.append(pyramid.means(level, j0, j1))
+            start = j1 * size
+        elif j1 > j0:
+            x.append(numpy.repeat(t[j0 * size:j1 * size:size], 2))
+            bins = numpy.empty(2 * (j1 - j0))
+            bins[0::2] = mins.values[j0:j1]
+            bins[1::2] = maxs.values[j0:j1]
+            values.append(bins)
+            start = j1 * size
+        level -= 1
+
+    # Samples that aren't in any full bin yet are drawn as they are
+    if start < i1:
+        x.append(t[start:i1])
+        values.append(y[start:i1])
+    return numpy.concatenate(x), numpy.concatenate(values)
@@ -0,0 +1,119 @@
+# Sources of packets that don't need a serial port
+# Recorded csv files or generated data can be sent through the same path as
+# data from base station, to test the app without a Cansat
+import csv
+import math
+import os
+import random
+import time
+from datetime import datetime
+
+from packets import FIELD_COUNT
+from schema import CHANNELS
+
+
+# Reads packets from a csv file saved by the app
+# Yields (time received, packet) for every row
+# Works with both new files, where data units are in separate columns, and old files,
+# where the whole packet is in one column and time has no date
+def read_log(file_name):
+    # Old files only have time of day, so date is taken from when the file was changed
+    day = datetime.fromtimestamp(os.path.getmtime(file_name)).date()
+    day_offset = 0
+    previous = None
+    with open(file_name, newline="", encoding="UTF8") as csv_f:
+        reader = csv.reader(csv_f)
+        for row in reader:
+            if not row or row[0] == "Time":
+                continue
+            if len(row) == 2:
+                received = datetime.combine(day, datetime.strptime(row[0], "%H:%M:%S").time()).timestamp()
+                # If time goes back a lot, midnight has passed
+                if previous is not None and received + day_offset < previous - 12 * 3600:
+                    day_offset += 24 * 3600
+                received += day_offset
+                packet = row[1]
+            else:
+                received = datetime.fromisoformat(row[0]).timestamp()
+                # Raw column has the whole packet if it was corrupted
+                raw = FIELD_COUNT + 1
+                packet = row[raw] if len(row) > raw and row[raw] else ",".join(row[1:raw])
+            previous = received
+            yield received, packet
+
+
+# Makes one packet that looks like a flight t seconds after launch
+def synthetic_packet(t, rng):
+    # Goes up for 5 minutes and comes down for 10 minutes, then starts again
+    phase = t % 900
+    if phase < 300:
+        altitude = 1000 * phase / 300
+    else:
+        altitude = 1000 * (900 - phase) / 600
+    values = {
+        "latitude": 57 + t * 1e-5 + rng.gauss(0, 1e-5),
+        "longitude": 25 + t * 2e-5 + rng.gauss(0, 1e-5),
+        "speed": abs(20 + 10 * math.sin(t / 30) + rng.gauss(0, 1)),
+        "alt": altitude + rng.gauss(0, 2),
+        "temp": 15 - altitude * 0.0065 + rng.gauss(0, 0.1),
+        "humid": 50 + 10 * math.sin(t / 100) + rng.gauss(0, 0.5),
+        "press": 101325 * (1 - 2.25577e-5 * altitude) ** 5.25588 + rng.gauss(0, 5),
+        "eco2": 400 + 50 * math.sin(t / 60) + rng.gauss(0, 5),
+        "co2": 410 + 50 * math.sin(t / 60) + rng.gauss(0, 5),
+        "tvoc": max(0.0, 100 + 30 * math.sin(t / 45) + rng.gauss(0, 5)),
+        "no2": max(0.0, 1 + 0.5 * math.sin(t / 80) + rng.gauss(0, 0.05)),
+        "pm10": max(0.0, 10 + 3 * math.sin(t / 50) + rng.gauss(0, 1)),
+        "pm25": max(0.0, 15 + 4 * math.sin(t / 50) + rng.gauss(0, 1)),
+        "pm100": max(0.0, 20 + 5 * math.sin(t / 50) + rng.gauss(0, 1)),
+        "rssi": -60 - altitude * 0.03 + rng.gauss(0, 2),
+        "snr": 8 - altitude * 0.005 + rng.gauss(0, 0.5),
+    }
+    # Channels added to schema that aren't simulated here are just noise
+    for name in CHANNELS:
+        if name not in values:
+            values[name] = rng.gauss(0, 1)
+    return ",".join(f"{values[name]:.6f}" if name in ("latitude", "longitude") else f"{values[name]:.2f}"
+                    for name in CHANNELS)
+
+
+# Changes one random symbol, like a bad radio link would do
+def corrupt_packet(packet, rng):
+    i = rng.randrange(len(packet))
+    return packet[:i] + rng.choice("x#?;") + packet[i + 1:]
+
+
+# Generates rate packets per second of a pretend flight
+# Yields (time received, packet), count limits how many packets are made
+# corrupt_rate is how big part of packets gets a corrupted symbol
+def synthetic_packets(rate, count=None, corrupt_rate=0.0, seed=None):
+    rng = random.Random(seed)
+    start = time.time()
+    i = 0
+    while count is None or i < count:
+        t = i / rate
+        packet = synthetic_packet(t, rng)
+        if rng.random() < corrupt_rate:
+            packet = corrupt_packet(packet, rng)
+        yield start + t, packet
+        i += 1
+
+
+# Sends packets from source to receive(time received, packet)
+# speed 1 sends them as fast as they were received, 10 sends them 10 times faster
+# and 0 sends them as fast as possible
+# stop is an optional threading.Event that ends replay early
+def replay(source, receive, speed=1.0, stop=None):
+    wall_start = None
+    for received, packet in source:
+        if stop is not None and stop.is_set():
+            return
+        if speed > 0:
+            now = time.monotonic()
+            if wall_start is None:
+                wall_start = now
+                first = received
+            # Waits until it is time to send this packet
+            delay = wall_start + (received - first) / speed - now
+            if delay > 0.001:
+                time.sleep(delay)
+        receive(received, packet)
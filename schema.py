@@ -0,0 +1,95 @@
+# Table of all data units and graphs
+# Packet parsing, storage, log file columns, binary frames and graphs are all made
+# from these tables, so adding a sensor only needs a new row here
+from collections import namedtuple
+
+
+# One data unit
+# name - name used in code, like store.column("temp")
+# index - position in packet, None for derived channels that aren't in packets
+# header - column name in log file
+# unit - unit of values
+# plot - name of graph the channel is drawn in, None if it isn't drawn
+# colour - colour of line, in pyqtgraph format
+# dtype, scale - type of data unit in binary frames and how much one step of it is,
+#                0.01 means the value is sent in hundredths
+# legend - name in legend of graph, None if channel is not in legend
+# dashed - if True, line is drawn dashed and thinner, for averages drawn over values
+Channel = namedtuple("Channel", ["name", "index", "header", "unit", "plot", "colour", "dtype", "scale", "legend",
+                                 "dashed"], defaults=[None, False])
+
+# Data units of a packet, in the order they are in packet
+FIELDS = [
+    Channel("latitude", 0, "Latititude", "deg", None, None, "<i4", 1e-7),
+    Channel("longitude", 1, "Longitude", "deg", None, None, "<i4", 1e-7),
+    Channel("speed", 2, "Speed", "km/h", "speed", "b", "<u2", 0.01),
+    Channel("alt", 3, "Altitude", "m", "altitude", "b", "<i4", 0.01, "GPS"),
+    Channel("temp", 4, "Temp", "Celsius", "temperature", "b", "<i2", 0.01),
+    Channel("humid", 5, "Humidity", "%", "humidity", "b", "<u2", 0.01),
+    Channel("press", 6, "Pressure", "Pa", "pressure", "b", "<i4", 0.01),
+    Channel("eco2", 7, "eCO2", "ppm", "co2", "g", "<u2", 1, "eCO2"),
+    Channel("co2", 8, "CO2", "ppm", "co2", "b", "<u2", 1, "CO2"),
+    Channel("tvoc", 9, "TVOC", "ug/m^3", "tvoc", "b", "<u2", 1, "TVOC"),
+    Channel("no2", 10, "NO2", "ppm", "no2", "b", "<u2", 0.01, "NO2"),
+    Channel("pm10", 11, "PM10", "ppm", "pms", "b", "<u2", 0.1, "PM10"),
+    Channel("pm25", 12, "PM25", "ppm", "pms", "g", "<u2", 0.1, "PM25"),
+    Channel("pm100", 13, "PM100", "ppm", "pms", "r", "<u2", 0.1, "PM100"),
+    Channel("rssi", 14, "RSSI", "dBm", None, None, "<i2", 0.1),
+    Channel("snr", 15, "SNR", "dB", None, None, "<i2", 0.01),
+]
+
+# Channels calculated by DerivedMetrics, stored after FIELDS
+# They aren't in packets, log files or frames
+DERIVED = [
+    Channel("vspeed", None, "Vertical speed", "m/s", "vspeed", "b", None, None),
+    Channel("baro_alt", None, "Barometric altitude", "m", "altitude", "g", None, None, "Barometric"),
+    Channel("co2_mean", None, "CO2 mean", "ppm", "co2", "k", None, None, "CO2 mean", True),
+    Channel("co2_std", None, "CO2 std", "ppm", "gas_std", "b", None, None, "CO2"),
+    Channel("tvoc_mean", None, "TVOC mean", "ug/m^3", "tvoc", "k", None, None, "Mean", True),
+    Channel("tvoc_std", None, "TVOC std", "ug/m^3", "gas_std", "g", None, None, "TVOC"),
+    Channel("no2_mean", None, "NO2 mean", "ppm", "no2", "k", None, None, "Mean", True),
+    Channel("no2_std", None, "NO2 std", "ppm", "gas_std", "r", None, None, "NO2"),
+    Channel("pm25_pm100", None, "PM25/PM100", "", "ratio", "b", None, None, "PM25/PM100"),
+    Channel("pm10_pm25", None, "PM10/PM25", "", "ratio", "g", None, None, "PM10/PM25"),
+]
+
+# One graph, row and column are its place in its tab of window
+# Tabs are shown in the order their first graph is here
+# First graph is the one other graphs are linked to
+Plot = namedtuple("Plot", ["name", "label", "row", "column", "tab"], defaults=["Data"])
+
+PLOTS = [
+    Plot("temperature", "Temperature, Celsius", 0, 0),
+    Plot("pressure", "Pressure, Pa", 1, 0),
+    Plot("humidity", "Humidity, %", 2, 0),
+    Plot("speed", "Speed, km/h", 0, 1),
+    Plot("altitude", "Altitude, meters", 1, 1),
+    Plot("co2", "Co2 concentration, ppm", 2, 1),
+    Plot("tvoc", "TVOC concentration, ug/m^3", 0, 2),
+    Plot("no2", "NO2 concentration, ppm", 1, 2),
+    Plot("pms", "Fine particles, ppm", 2, 2),
+    # Graphs of derived channels are in their own tab, so data graphs keep their size
+    Plot("vspeed", "Vertical speed, m/s", 0, 0, "Derived"),
+    Plot("gas_std", "Rolling gas std", 1, 0, "Derived"),
+    Plot("ratio", "Fine particle ratios", 2, 0, "Derived"),
+]
+
+# Names of data units in the order they come in a packet
+CHANNELS = [field.name for field in FIELDS]
+DERIVED_CHANNELS = [channel.name for channel in DERIVED]
+
+
+# Finds mistakes in tables when app starts, instead of when data arrives
+def _check():
+    if [field.index for field in FIELDS] != list(range(len(FIELDS))):
+        raise ValueError("FIELDS must be in packet order with indexes 0, 1, 2, ...")
+    names = CHANNELS + DERIVED_CHANNELS
+    if len(set(names)) != len(names):
+        raise ValueError("Channel names must be different")
+    plots = {plot.name for plot in PLOTS}
+    for channel in FIELDS + DERIVED:
+        if channel.plot is not None and channel.plot not in plots:
+            raise ValueError(f"Channel {channel.name} has unknown plot {channel.plot}")
+
+
+_check()
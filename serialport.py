@@ -0,0 +1,225 @@
+# Reads packets from base stations over serial ports
+# All ports are read from one thread with asyncio, using pyserial without blocking
+# Base stations can be found by USB id of their serial chip, and if a base station
+# is unplugged it is connected again when it comes back
+# Doesn't need Qt, so it is used both by the app and by the recorder
+# Base stations can send text packets or binary frames (see frames.py), or both
+import asyncio
+import time
+
+import numpy
+import serial
+from serial.tools import list_ports
+
+from frames import FRAME_SIZE, count_lost, decode_frames, find_frames, format_packets
+from metrics import METRICS
+from packets import PacketBatch
+
+
+# USB (vendor id, product id) of serial chips used in base stations
+# None as product id means every product of that vendor
+BASE_STATION_IDS = [
+    (0x2341, None),  # Arduino
+    (0x2A03, None),  # Arduino clones
+    (0x1A86, 0x7523),  # CH340
+    (0x0403, 0x6001),  # FTDI FT232R
+    (0x10C4, 0xEA60),  # CP210x
+]
+
+# How long to wait when there is no new data, in seconds
+POLL_INTERVAL = 0.01
+# How often ports are searched again when base stations are found automatically
+SCAN_INTERVAL = 2.0
+# Longest time to wait before trying to connect again
+MAX_BACKOFF = 5.0
+# If a line gets longer than this without a line ending, it is garbage and is dropped
+MAX_LINE = 4096
+# Lost frames are printed at most this often, in seconds
+LOSS_REPORT_INTERVAL = 5.0
+
+
+# Names of ports that have a base station connected
+def find_base_stations(ids=BASE_STATION_IDS):
+    ports = []
+    for port in list_ports.comports():
+        for vid, pid in ids:
+            if port.vid == vid and (pid is None or port.pid == pid):
+                ports.append(port.device)
+                break
+    return sorted(ports)
+
+
+# Splits bytes from serial port to lines
+# Bytes after the last line ending are kept until the rest of line arrives
+class LineFramer:
+    def __init__(self):
+        self.pending = b""
+
+    # Returns complete lines in data, without line endings
+    def feed(self, data):
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        if len(self.pending) > MAX_LINE:
+            self.pending = b""
+        # Bytes that aren't text are shown as \x.. like before
+        return [line.rstrip(b"\r").decode("ascii", errors="backslashreplace") for line in lines]
+
+    def reset(self):
+        self.pending = b""
+
+
+# Splits bytes from serial port to packets, both binary frames and text lines
+# Frames are decoded together to values and are not changed to text, so they
+# don't have to be parsed again
+class PacketFramer:
+    def __init__(self):
+        self.lines = LineFramer()
+        # Start of a frame that hasn't fully arrived yet
+        self.pending = b""
+        self.last_seq = None
+        # Frames missing from sequence since framer was made, frames with a bad CRC
+        # are dropped so they are counted in lost too
+        self.lost = 0
+        self.bad_crc = 0
+
+    # Returns complete text packets in data and values of complete frames, one
+    # row per frame with NaN for missing data units, or None if there were no frames
+    def feed(self, data):
+        data = self.pending + data
+        self.pending = b""
+        offsets, rejected, incomplete = find_frames(data)
+        self.bad_crc += len(rejected)
+        if rejected:
+            METRICS.count("frames.bad_crc", len(rejected))
+        if incomplete is not None:
+            self.pending = data[incomplete:]
+            data = data[:incomplete]
+        if not offsets and not rejected:
+            return self.lines.feed(data), None
+        values = None
+        if offsets:
+            seq, values = decode_frames(data, offsets)
+            lost = count_lost(seq, self.last_seq)
+            self.lost += lost
+            self.last_seq = int(seq[-1])
+            METRICS.count("frames.received", len(offsets))
+            if lost:
+                METRICS.count("frames.lost", lost)
+        # Bytes of frames, also ones with a bad CRC, are skipped and only text between them is read as lines
+        frames = sorted([(offset, offset + FRAME_SIZE) for offset in offsets] + rejected)
+        packets = []
+        start = 0
+        for offset, stop in frames:
+            packets.extend(self.lines.feed(data[start:offset]))
+            # Text line can't continue over a frame, so binary bytes never start a line
+            self.lines.reset()
+            start = stop
+        packets.extend(self.lines.feed(data[start:]))
+        return packets, values
+
+    def reset(self):
+        self.lines.reset()
+        self.pending = b""
+        self.last_seq = None
+
+
+# Reads one port until stop is set
+# receive(time received, packet, port) is called for every line
+# Lost connections are opened again, waiting longer after every failed try
+# present - for ports found by scanning, function that tells if port is still found,
+#           reading stops when port can't be opened and isn't found anymore
+# receive_frames - if given, receive_frames(batch) is called with a PacketBatch of
+#                  frames of every read, batch has no text packets
+#                  If not given, frames are changed to text and given to receive
+async def read_port(port, baudrate, receive, stop, present=None, receive_frames=None):
+    framer = PacketFramer()
+    reported = last_report = 0
+    backoff = 0.25
+    while not stop.is_set():
+        try:
+            # timeout=0 makes reading return immediately with what has arrived
+            base_station = serial.Serial(port, baudrate, timeout=0)
+        except (serial.SerialException, OSError):
+            # Base station has been unplugged, scanning starts reading again when it is back
+            if present is not None and not present():
+                return
+            print("No Connection to", port)
+            await asyncio.sleep(backoff)
+            # Waits longer every time, so a missing port isn't tried all the time
+            backoff = min(backoff * 2, MAX_BACKOFF)
+            continue
+        print("Connected to", port)
+        backoff = 0.25
+        framer.reset()
+        try:
+            while not stop.is_set():
+                # Reads everything that has arrived at once
+                start = time.perf_counter()
+                data = base_station.read(max(base_station.in_waiting, 1))
+                if not data:
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                # Time when data was received, gui uses it for graphs
+                received = time.time()
+                packets, values = framer.feed(data)
+                for packet in packets:
+                    receive(received, packet, port)
+                count = len(packets)
+                if values is not None:
+                    count += len(values)
+                    if receive_frames is not None:
+                        receive_frames(frame_batch(received, values, port))
+                    else:
+                        for packet in format_packets(values):
+                            receive(received, packet, port)
+                # Time of reading, framing and handing packets on, for one read
+                METRICS.observe("serial.read", time.perf_counter() - start)
+                METRICS.count("serial.bytes", len(data))
+                METRICS.count("serial.packets", count)
+                # Frames with a bad CRC are dropped, so they are part of lost frames
+                lost = framer.lost
+                if lost != reported and time.monotonic() - last_report >= LOSS_REPORT_INTERVAL:
+                    print(port, "lost", framer.lost, "frames,", framer.bad_crc, "of them had bad CRC")
+                    reported, last_report = lost, time.monotonic()
+        except (serial.SerialException, OSError):
+            # If something goes wrong closes port and tries again
+            print("Disconnecting", port)
+            METRICS.count("serial.disconnects")
+        finally:
+            base_station.close()
+
+
+# PacketBatch of decoded frames that were received at the same time
+# Data units that were missing in frame are not valid
+def frame_batch(received, values, source=None):
+    valid = numpy.isfinite(values)
+    return PacketBatch(numpy.full(len(values), received), [], values, valid, valid.all(axis=1), source)
+
+
+# Reads all given ports, or finds base stations by USB id if ports is empty
+# Found ports are searched again every SCAN_INTERVAL seconds, so base stations can
+# be plugged in and out while reading
+async def read_ports(ports, baudrate, receive, stop, receive_frames=None):
+    if ports:
+        await asyncio.gather(*(read_port(port, baudrate, receive, stop, receive_frames=receive_frames)
+                               for port in ports))
+        return
+    tasks = {}
+    found = set()
+    while not stop.is_set():
+        found = set(find_base_stations())
+        for port in found:
+            if port not in tasks or tasks[port].done():
+                tasks[port] = asyncio.ensure_future(read_port(port, baudrate, receive, stop,
+                                                              lambda port=port: port in found, receive_frames))
+        if not tasks:
+            print("No base station found")
+        await asyncio.sleep(SCAN_INTERVAL)
+    await asyncio.gather(*tasks.values())
+
+
+# Reads serial ports until stop (threading.Event) is set
+# Meant to be run in its own thread, one thread reads all ports
+# receive_frames is passed to read_port
+def run_serial(ports, baudrate, receive, stop, receive_frames=None):
+    asyncio.run(read_ports(list(ports), baudrate, receive, stop, receive_frames))
@@ -0,0 +1,210 @@
+# Loads recorded sessions for looking at them after the flight
+# A session is a csv file saved by the app or recorder, or a folder of .npz chunks
+# Parsed data, derived channels, min/max/mean pyramids of every channel and the
+# simplified GPS track are cached in a folder next to the log, so a session opens
+# instantly the second time. Cached arrays are memory-mapped and used without
+# copying, so they don't have to be read from disk all at once
+#
+# To open a session:
+#     python main.py --open data1234.csv
+import csv
+import itertools
+import json
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy
+
+from derived import DerivedMetrics
+from logger import load_npz
+from maptrack import acquired_points, simplify_track
+from packets import FIELD_COUNT, parse_packets
+from render import SummaryPyramid
+from replay import read_log
+from schema import CHANNELS, DERIVED_CHANNELS
+from storage import TelemetryStore
+
+
+# How many rows of csv are parsed at once
+CHUNK_ROWS = 200000
+# Changed when format of cache changes, so old caches are made again
+CACHE_VERSION = 2
+
+# Channels of a session, received channels first and derived after them like in app
+SESSION_CHANNELS = CHANNELS + DERIVED_CHANNELS
+
+# Loaded session
+# store - TelemetryStore with all SESSION_CHANNELS
+# pyramids - SummaryPyramid for every channel
+# track - simplified GPS track as (latitudes, longitudes)
+Session = namedtuple("Session", ["store", "pyramids", "track"])
+
+
+# Folder where cache of a session is kept, data1234.csv -> data1234.cache
+def cache_folder(path):
+    path = os.path.normpath(path)
+    if path.endswith(".csv"):
+        path = path[:-4]
+    return path + ".cache"
+
+
+# Size and time of change of every file in session, cache is only used if these are the same
+def _signature(path):
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.endswith(".npz"))
+        files = [os.path.join(path, name) for name in names]
+    else:
+        files = [path]
+    return [[os.path.basename(name), os.path.getsize(name), os.stat(name).st_mtime_ns] for name in files]
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+# Changes times written by logger in local time to Unix timestamps
+# Offset from UTC is found once for every hour, not for every row
+def _local_timestamps(times):
+    naive = numpy.array(times, dtype="datetime64[ms]").astype(numpy.int64) / 1000.0
+    hours, inverse = numpy.unique(numpy.floor(naive / 3600), return_inverse=True)
+    offsets = numpy.array([hour * 3600 - (_EPOCH + timedelta(hours=hour)).timestamp() for hour in hours.tolist()])
+    return naive - offsets[inverse.reshape(-1)]
+
+
+# Splits rows of a csv file to times and packets
+# Rows are split by hand, only rows that have quotes in them need the csv module
+def _split_rows(lines):
+    times = []
+    packets = []
+    for line in lines:
+        if '"' in line:
+            for row in csv.reader([line]):
+                times.append(row[0])
+                packets.append(",".join(row[1:FIELD_COUNT + 1]))
+            continue
+        time_string, _, rest = line.partition(",")
+        times.append(time_string)
+        # Last column is raw packet, it is only there if packet was corrupted
+        packets.append(rest[:rest.rfind(",")])
+    return times, packets
+
+
+# Reads a csv file in chunks, every chunk is parsed with parse_packets
+def _load_csv(path):
+    timestamps = []
+    values = []
+    with open(path, encoding="UTF8") as csv_f:
+        while True:
+            lines = [line.rstrip("\r\n") for line in itertools.islice(csv_f, CHUNK_ROWS)]
+            if not lines:
+                break
+            lines = [line for line in lines if line and not line.startswith("Time,")]
+            if lines and len(next(csv.reader(lines[:1]))) == 2:
+                # Old file where time has no date, read_log knows how to read it
+                return _load_old_csv(path)
+            times, packets = _split_rows(lines)
+            # Fields that couldn't be read were saved empty, so they become NaN again
+            timestamps.append(_local_timestamps(times))
+            values.append(parse_packets(packets).values)
+    if not timestamps:
+        return numpy.empty(0), numpy.empty((0, FIELD_COUNT))
+    return numpy.concatenate(timestamps), numpy.concatenate(values)
+
+
+def _load_old_csv(path):
+    rows = list(read_log(path))
+    timestamps = numpy.array([received for received, _ in rows], dtype=numpy.float64)
+    return timestamps, parse_packets([packet for _, packet in rows]).values
+
+
+# Reads session without cache
+# Returns timestamps and values with one row of data units per sample
+# Samples where nothing could be read are left out
+def read_session(path):
+    if os.path.isdir(path):
+        timestamps, values = load_npz(path)
+    else:
+        timestamps, values = _load_csv(path)
+    usable = numpy.isfinite(values).any(axis=1)
+    return timestamps[usable], values[usable]
+
+
+# Pyramids of all channels have the same levels, so every kind of summary is saved
+# as one array with a row for every channel, and it can be memory-mapped when loaded
+_SUMMARIES = ("min", "max", "sum", "count")
+
+
+# Array in the layout of TelemetryStore, with derived channels calculated from values
+def _store_data(timestamps, values):
+    data = numpy.empty((len(SESSION_CHANNELS) + 1, len(timestamps)))
+    data[0] = timestamps
+    data[1:FIELD_COUNT + 1] = values.T
+    data[FIELD_COUNT + 1:] = DerivedMetrics().update(timestamps, values).T
+    return data
+
+
+# Makes session from array made by _store_data, pyramids and track are calculated here
+def _make_session(data):
+    store = TelemetryStore.wrap(data, SESSION_CHANNELS)
+    pyramids = {}
+    for channel in SESSION_CHANNELS:
+        pyramids[channel] = SummaryPyramid()
+        pyramids[channel].update(store.column(channel))
+    track = simplify_track(*acquired_points(store.column("latitude"), store.column("longitude")))
+    return Session(store, pyramids, track)
+
+
+def _save_cache(folder, signature, data, session):
+    os.makedirs(folder, exist_ok=True)
+    # Saved in the layout of store, so it can be used by store as it is
+    numpy.save(os.path.join(folder, "store.npy"), data)
+    numpy.save(os.path.join(folder, "track.npy"), numpy.array(session.track))
+    arrays = [session.pyramids[channel].to_arrays() for channel in SESSION_CHANNELS]
+    for name in _SUMMARIES:
+        numpy.save(os.path.join(folder, f"summary_{name}.npy"), numpy.stack([a[name] for a in arrays]))
+    # Meta file is written last, so a cache that wasn't fully saved is never used
+    with open(os.path.join(folder, "meta.json"), "w") as f:
+        json.dump({"version": CACHE_VERSION, "files": signature, "channels": SESSION_CHANNELS,
+                   "sizes": arrays[0]["sizes"].tolist()}, f)
+
+
+def _load_cache(folder, signature):
+    try:
+        with open(os.path.join(folder, "meta.json")) as f:
+            meta = json.load(f)
+        # Cache is made again if log file or channels in schema.py have changed
+        if meta.get("version") != CACHE_VERSION or meta.get("files") != signature or \
+                meta.get("channels") != SESSION_CHANNELS:
+            return None
+        data = numpy.load(os.path.join(folder, "store.npy"), mmap_mode="r")
+        latitudes, longitudes = numpy.load(os.path.join(folder, "track.npy"))
+        summaries = {name: numpy.load(os.path.join(folder, f"summary_{name}.npy"), mmap_mode="r")
+                     for name in _SUMMARIES}
+        sizes = numpy.array(meta["sizes"], dtype=numpy.int64)
+        pyramids = {}
+        for i, channel in enumerate(SESSION_CHANNELS):
+            arrays = {name: summary[i] for name, summary in summaries.items()}
+            arrays["sizes"] = sizes
+            pyramids[channel] = SummaryPyramid.from_arrays(arrays)
+    except (OSError, ValueError, KeyError):
+        return None
+    return Session(TelemetryStore.wrap(data, SESSION_CHANNELS), pyramids, (latitudes, longitudes))
+
+
+# Loads a session, from cache if it has one
+# Returns a Session
+def load_session(path, use_cache=True):
+    signature = _signature(path)
+    folder = cache_folder(path)
+    if use_cache:
+        cached = _load_cache(folder, signature)
+        if cached is not None:
+            return cached
+    data = _store_data(*read_session(path))
+    session = _make_session(data)
+    try:
+        _save_cache(folder, signature, data, session)
+    except OSError as e:
+        # Session can still be shown, it is only slower to open next time
+        print("Couldn't save cache of", path, e)
+    return session
@@ -0,0 +1,205 @@
+# Ring buffer in shared memory for sending samples from recorder to viewers
+# Data is in the same layout as in TelemetryStore: row 0 is timestamps and the
+# other rows are channels, so viewers can use NumPy views of it without any
+# pickling or messages per sample
+# There is one writer and any number of readers. Every sample has a sequence
+# number, so readers know when the writer has overwritten samples they haven't read
+import secrets
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy
+
+from packets import FIELD_COUNT, PacketBatch
+
+
+# Name of shared memory block used by default
+SHM_NAME = "cansat_telemetry"
+# How many samples fit in the ring
+SHM_CAPACITY = 1 << 16
+
+# First value of header, so a reader doesn't use some other block by mistake
+_MAGIC = 0x43414E534154  # "CANSAT"
+# Header is 8 int64 values: magic, capacity, channels, samples written so far,
+# samples written when the write that is going on ends, generation, rest unused
+# Generation is a random number of every writer, it is 0 after writer has closed
+_HEADER = 8
+_SEQ = 3
+_WRITING = 4
+_GENERATION = 5
+
+
+# Blocks opened by readers must not be removed when the reader closes
+# Before Python 3.13 resource tracker would remove them on POSIX
+def _open_block(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    block = shared_memory.SharedMemory(name=name)
+    if sys.platform != "win32":
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+def _views(block):
+    header = numpy.ndarray((_HEADER,), dtype=numpy.int64, buffer=block.buf)
+    capacity, channels = int(header[1]), int(header[2])
+    data = numpy.ndarray((channels + 1, capacity), dtype=numpy.float64, buffer=block.buf, offset=_HEADER * 8)
+    return header, data
+
+
+class ShmRingWriter:
+    def __init__(self, name=SHM_NAME, capacity=SHM_CAPACITY, channels=FIELD_COUNT):
+        size = _HEADER * 8 + (channels + 1) * capacity * 8
+        try:
+            self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Block was left behind by a recorder that didn't close properly
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            self.block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = numpy.ndarray((_HEADER,), dtype=numpy.int64, buffer=self.block.buf)
+        header[:] = 0
+        header[1] = capacity
+        header[2] = channels
+        header[_GENERATION] = secrets.randbits(62) + 1
+        header[0] = _MAGIC
+        self.header, self.data = _views(self.block)
+        self.capacity = capacity
+
+    # Adds samples, values has one row of channels per sample
+    def write(self, timestamps, values):
+        count = len(timestamps)
+        if count == 0:
+            return
+        # If there are more samples than fit in the ring, only the last ones are kept
+        seq = int(self.header[_SEQ])
+        if count > self.capacity:
+            timestamps = timestamps[-self.capacity:]
+            values = values[-self.capacity:]
+            seq += count - self.capacity
+            count = self.capacity
+        # End of write is published before data is changed, so readers know
+        # which samples may be overwritten while they copy them
+        self.header[_WRITING] = seq + count
+        start = seq % self.capacity
+        first = min(count, self.capacity - start)
+        # Samples that don't fit before the end of ring go to the beginning
+        self.data[0, start:start + first] = timestamps[:first]
+        self.data[1:, start:start + first] = values[:first].T
+        if first < count:
+            self.data[0, :count - first] = timestamps[first:]
+            self.data[1:, :count - first] = values[first:].T
+        # Sequence number is changed last, so readers never see samples that aren't written yet
+        self.header[_SEQ] = seq + count
+
+    def close(self):
+        # Readers see that this block won't get new samples anymore
+        self.header[_GENERATION] = 0
+        self.header = self.data = None
+        self.block.close()
+        self.block.unlink()
+
+
+class ShmRingReader:
+    # Starts from samples that are written after the reader is opened, or with
+    # from_start from the oldest sample that is still in the ring
+    def __init__(self, name=SHM_NAME, from_start=False):
+        self.block = _open_block(name)
+        self.header, self.data = _views(self.block)
+        if int(self.header[0]) != _MAGIC:
+            raise ValueError(f"Shared memory {name} is not a telemetry ring")
+        self.name = name
+        self.generation = int(self.header[_GENERATION])
+        self.capacity = self.data.shape[1]
+        self.position = int(self.header[_SEQ])
+        if from_start:
+            self.position = max(self.position - self.capacity, 0)
+        # How many samples were overwritten before this reader got to them
+        self.lost = 0
+
+    # Returns timestamps and values of samples written since last read,
+    # and how many samples were lost this time
+    def read(self):
+        end = int(self.header[_SEQ])
+        # Samples older than one ring have already been overwritten
+        start = max(self.position, end - self.capacity)
+        lost = start - self.position
+        indexes = numpy.arange(start, end) % self.capacity
+        samples = self.data[:, indexes]
+        # Writer may have overwritten some samples while they were copied, or may
+        # be overwriting them now, they are dropped and counted as lost
+        overwritten = int(self.header[_WRITING]) - self.capacity - start
+        if overwritten > 0:
+            samples = samples[:, overwritten:]
+            lost += overwritten
+        self.position = end
+        self.lost += lost
+        return samples[0], samples[1:].T, lost
+
+    # True if writer has closed this block
+    def closed(self):
+        return int(self.header[_GENERATION]) != self.generation
+
+    # True if writer has closed this block, or a new writer has made a new block
+    # with the same name, like when recorder is restarted. Reader must then be opened again
+    def replaced(self):
+        if self.closed():
+            return True
+        try:
+            block = _open_block(self.name)
+        except (FileNotFoundError, ValueError):
+            return False
+        try:
+            header = numpy.ndarray((_HEADER,), dtype=numpy.int64, buffer=block.buf)
+            generation = int(header[_GENERATION])
+            del header
+        finally:
+            block.close()
+        return generation != self.generation
+
+    def close(self):
+        self.header = self.data = None
+        self.block.close()
+
+
+# If a reader gets no samples for this many seconds, it checks if recorder has been restarted
+REOPEN_INTERVAL = 1.0
+
+
+# Reads ring every interval seconds and calls receive(batch) with new samples as PacketBatch
+# Samples don't have raw packets, so batches have no packets for consoles
+# Used by app when it is started with --attach-shm
+def follow_shm(receive, name=SHM_NAME, interval=0.05, stop=None):
+    reader = None
+    # After recorder is restarted, all samples of the new ring are new
+    restarted = False
+    while stop is None or not stop.is_set():
+        if reader is None:
+            try:
+                reader = ShmRingReader(name, from_start=restarted)
+                print("Attached to shared memory", name)
+            except (FileNotFoundError, ValueError):
+                time.sleep(1.0)
+                continue
+            last_data = time.monotonic()
+        timestamps, values, lost = reader.read()
+        if lost:
+            print("Shared memory reader lost", lost, "samples")
+        if len(timestamps):
+            valid = numpy.isfinite(values)
+            receive(PacketBatch(timestamps, [], values, valid, valid.all(axis=1)))
+            last_data = time.monotonic()
+        elif reader.closed() or time.monotonic() - last_data >= REOPEN_INTERVAL:
+            if reader.replaced():
+                print("Shared memory", name, "was made again by recorder, attaching again")
+                reader.close()
+                reader = None
+                restarted = True
+                continue
+            last_data = time.monotonic()
+        time.sleep(interval)
+    if reader is not None:
+        reader.close()
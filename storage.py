@@ -0,0 +1,80 @@
+# Columnar storage for received telemetry
+# Every channel is kept in its own row of one float64 NumPy array, so
+# graphs can get a channel as an array without any copying or converting
+import numpy
+
+# Names of data units in the order they come in a packet, from schema.py
+from schema import CHANNELS
+
+
+class TelemetryStore:
+    def __init__(self, channels=CHANNELS, capacity=1024):
+        self.channels = list(channels)
+        # Row of every channel in data array, row 0 is used for timestamps
+        self._rows = {name: i + 1 for i, name in enumerate(self.channels)}
+        self.size = 0
+        # Each row is one channel, so every channel is contiguous in memory
+        self._data = numpy.empty((len(self.channels) + 1, capacity))
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return self._data.shape[1]
+
+    # Makes array bigger if new samples don't fit in it
+    # Capacity is doubled, so appending stays cheap even for very long flights
+    def _reserve(self, needed):
+        if needed <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        data = numpy.empty((self._data.shape[0], capacity))
+        data[:, :self.size] = self._data[:, :self.size]
+        self._data = data
+
+    # Store that shows data without copying it, data has timestamps in row 0 and
+    # a row for every channel after it, like the array of a store
+    # Data is copied only when something is appended, so it can be a read-only
+    # memory-mapped array
+    @classmethod
+    def wrap(cls, data, channels=CHANNELS):
+        store = cls(channels)
+        if data.shape[1]:
+            store._data = data
+            store.size = data.shape[1]
+        return store
+
+    # Appends many samples at once
+    # timestamps has one value per sample and rows has one row of all channels per sample
+    def append(self, timestamps, rows):
+        timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+        rows = numpy.asarray(rows, dtype=numpy.float64).reshape(len(timestamps), len(self.channels))
+        count = len(timestamps)
+        if count == 0:
+            return
+        self._reserve(self.size + count)
+        self._data[0, self.size:self.size + count] = timestamps
+        self._data[1:, self.size:self.size + count] = rows.T
+        self.size += count
+
+    # Appends one sample
+    def append_row(self, timestamp, row):
+        self.append([timestamp], [row])
+
+    # Views to stored data, they are only valid until next append
+    @property
+    def timestamps(self):
+        return self._data[0, :self.size]
+
+    def column(self, name):
+        return self._data[self._rows[name], :self.size]
+
+    # Removes all stored samples, but keeps allocated memory
+    # Memory of wrapped read-only data can't be used, so a new array is made for it
+    def clear(self):
+        self.size = 0
+        if not self._data.flags.writeable:
+            self._data = numpy.empty((self._data.shape[0], 1024))
@@ -0,0 +1,6 @@
+# Modules of the app are in the repository folder, so tests can be run with
+# pytest from anywhere
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,49 @@
+import numpy
+
+from derived import DerivedMetrics
+from schema import CHANNELS, DERIVED_CHANNELS
+
+VSPEED = DERIVED_CHANNELS.index("vspeed")
+
+
+def _flight(count, seed=0):
+    rng = numpy.random.default_rng(seed)
+    t = numpy.arange(count) * 0.1
+    # Packets of one serial read have the same time
+    t = t[numpy.minimum((numpy.arange(count) // 5) * 5 + 4, count - 1)]
+    values = rng.normal(100, 10, size=(count, len(CHANNELS)))
+    values[:, CHANNELS.index("alt")] = 5.0 * numpy.arange(count) * 0.1
+    values[rng.random(values.shape) < 0.05] = numpy.nan
+    return t, values
+
+
+def test_same_result_however_stream_is_split():
+    t, values = _flight(3000)
+    whole = DerivedMetrics().update(t, values)
+    for seed in range(3):
+        derived = DerivedMetrics()
+        bounds = numpy.sort(numpy.random.default_rng(seed).choice(numpy.arange(1, len(t)), 40, replace=False))
+        parts = [derived.update(t[a:b], values[a:b]) for a, b in zip(numpy.r_[0, bounds], numpy.r_[bounds, len(t)])]
+        assert numpy.allclose(numpy.vstack(parts), whole, rtol=1e-9, atol=1e-9, equal_nan=True)
+
+
+def test_grouped_times_give_same_vertical_speed():
+    count = 2000
+    t = numpy.arange(count) * 0.1
+    values = numpy.full((count, len(CHANNELS)), numpy.nan)
+    values[:, CHANNELS.index("alt")] = 5.0 * t
+    one_by_one = DerivedMetrics().update(t, values)[:, VSPEED]
+    # Seven packets every read, time is when the read happened
+    grouped_t = t[numpy.minimum((numpy.arange(count) // 7) * 7 + 6, count - 1)]
+    grouped = DerivedMetrics().update(grouped_t, values)[:, VSPEED]
+    assert abs(one_by_one[1500] - 5.0) < 1e-6
+    assert abs(grouped[1500] - 5.0) < 1e-6
+
+
+def test_clear_starts_again():
+    t, values = _flight(500)
+    derived = DerivedMetrics()
+    first = derived.update(t, values)
+    derived.update(t + 100, values)
+    derived.clear()
+    assert numpy.allclose(derived.update(t, values), first, equal_nan=True)
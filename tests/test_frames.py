@@ -0,0 +1,78 @@
+import numpy
+
+from frames import FRAME_SIZE, _SCALES, count_lost, decode_frames, encode_frames, find_frames
+from packets import FIELD_COUNT, parse_packets
+from replay import synthetic_packets
+from serialport import PacketFramer
+
+
+def _values(count):
+    values = parse_packets([packet for _, packet in synthetic_packets(10, count, 0.0, 1)]).values
+    # Some data units are missing, they must come back as NaN
+    values[count // 2, 3] = numpy.nan
+    values[count - 1, 0] = numpy.nan
+    return values
+
+
+def test_round_trip():
+    values = _values(20)
+    data = encode_frames(values)
+    assert len(data) == 20 * FRAME_SIZE
+    offsets, rejected, incomplete = find_frames(data)
+    assert offsets == [i * FRAME_SIZE for i in range(20)]
+    assert rejected == [] and incomplete is None
+    seq, decoded = decode_frames(data, offsets)
+    assert seq.tolist() == list(range(20))
+    assert numpy.array_equal(numpy.isnan(decoded), numpy.isnan(values))
+    finite = numpy.isfinite(values)
+    assert numpy.all(numpy.abs(decoded - values)[finite] <= numpy.broadcast_to(_SCALES / 2, values.shape)[finite] + 1e-9)
+
+
+def test_bad_crc_is_dropped():
+    data = bytearray(encode_frames(_values(3)))
+    # Changes a byte in the payload of the middle frame
+    data[FRAME_SIZE + 10] ^= 0xFF
+    offsets, rejected, incomplete = find_frames(bytes(data))
+    assert offsets == [0, 2 * FRAME_SIZE]
+    assert rejected == [(FRAME_SIZE, 2 * FRAME_SIZE)]
+    assert incomplete is None
+
+
+def test_cut_off_frame_waits_for_rest():
+    values = _values(3)
+    data = encode_frames(values)
+    framer = PacketFramer()
+    lines, first = framer.feed(data[:FRAME_SIZE + 20])
+    assert lines == [] and len(first) == 1
+    lines, rest = framer.feed(data[FRAME_SIZE + 20:])
+    assert lines == [] and len(rest) == 2
+    assert numpy.allclose(numpy.vstack((first, rest)), decode_frames(data, [0, FRAME_SIZE, 2 * FRAME_SIZE])[1],
+                          equal_nan=True)
+    assert framer.lost == 0 and framer.bad_crc == 0
+
+
+def test_frame_cut_short_by_next_frame():
+    data = encode_frames(_values(2))
+    # First frame lost its last bytes, second frame must still be found
+    data = data[:FRAME_SIZE - 5] + data[FRAME_SIZE:]
+    offsets, rejected, _ = find_frames(data)
+    assert offsets == [FRAME_SIZE - 5]
+    assert rejected == [(0, FRAME_SIZE - 5)]
+
+
+def test_text_between_frames():
+    data = b"1,2\n" + encode_frames(_values(1)) + b"3,4\n"
+    lines, values = PacketFramer().feed(data)
+    assert lines == ["1,2", "3,4"]
+    assert values.shape == (1, FIELD_COUNT)
+
+
+def test_sequence_wraps_around():
+    seq, _ = decode_frames(encode_frames(_values(4), first_seq=65534), [i * FRAME_SIZE for i in range(4)])
+    assert seq.tolist() == [65534, 65535, 0, 1]
+    # 0 is a restart of Cansat, so nothing is lost there
+    assert count_lost(seq) == 0
+    assert count_lost(numpy.array([65535, 2])) == 2
+    assert count_lost(numpy.array([5]), previous=65533) == 7
+    # Repeated frame is not lost
+    assert count_lost(numpy.array([7, 7, 8])) == 0
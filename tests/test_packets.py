@@ -0,0 +1,42 @@
+import numpy
+
+from packets import FIELD_COUNT, parse_batch, parse_packets
+
+
+def _packet(fields):
+    return ",".join(fields)
+
+
+GOOD = [str(i + 0.5) for i in range(FIELD_COUNT)]
+
+
+def test_good_packets():
+    parsed = parse_packets([_packet(GOOD)] * 3)
+    assert parsed.valid.all() and parsed.ok.all()
+    assert parsed.values[0].tolist() == [i + 0.5 for i in range(FIELD_COUNT)]
+
+
+def test_corrupt_field_only_invalidates_that_field():
+    fields = list(GOOD)
+    fields[4] = "1#.5"
+    fields[9] = ""
+    parsed = parse_packets([_packet(GOOD), _packet(fields), _packet(GOOD)])
+    assert parsed.ok.tolist() == [True, False, True]
+    expected = numpy.ones(FIELD_COUNT, dtype=bool)
+    expected[[4, 9]] = False
+    assert parsed.valid[1].tolist() == expected.tolist()
+    assert numpy.isnan(parsed.values[1, [4, 9]]).all()
+    assert parsed.values[1, 5] == 5.5
+
+
+def test_wrong_number_of_fields_is_all_invalid():
+    parsed = parse_packets([_packet(GOOD[:-1]), _packet(GOOD + ["1"]), "garbage"])
+    assert not parsed.valid.any()
+    assert not parsed.ok.any()
+
+
+def test_batch():
+    batch = parse_batch([1.0, 2.0], [_packet(GOOD), "x"], "COM1")
+    assert batch.timestamps.tolist() == [1.0, 2.0]
+    assert batch.ok.tolist() == [True, False]
+    assert batch.source == "COM1"
@@ -0,0 +1,41 @@
+import argparse
+
+import numpy
+import pytest
+
+from packets import FIELD_COUNT, parse_batch
+from recorder import decode_batch, encode_batch, parse_address
+from serialport import frame_batch
+
+
+def test_batch_round_trip():
+    batch = parse_batch([1.0, 2.0], ["1,2", "x"], "COM1")
+    decoded = decode_batch(encode_batch(batch))
+    assert decoded.packets == ["1,2", "x"]
+    assert decoded.source == "COM1"
+    for name in ("timestamps", "values", "valid", "ok"):
+        assert numpy.array_equal(getattr(decoded, name), getattr(batch, name), equal_nan=True)
+
+
+def test_frame_batch_has_no_packets():
+    values = numpy.ones((3, FIELD_COUNT))
+    values[1, 2] = numpy.nan
+    decoded = decode_batch(encode_batch(frame_batch(5.0, values, "COM2")))
+    assert decoded.packets == []
+    assert decoded.ok.tolist() == [True, False, True]
+    assert decoded.timestamps.tolist() == [5.0, 5.0, 5.0]
+
+
+def test_bad_batches_are_rejected():
+    data = encode_batch(parse_batch([1.0], ["1,2"]))
+    with pytest.raises(ValueError):
+        decode_batch(data[:-1])
+    with pytest.raises(ValueError):
+        decode_batch(b"XXXX" + data[4:])
+
+
+def test_only_local_addresses():
+    assert parse_address("127.0.0.1:5000") == ("127.0.0.1", 5000)
+    assert parse_address("[::1]:5000") == ("::1", 5000)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_address("0.0.0.0:5000")
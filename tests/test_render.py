@@ -0,0 +1,49 @@
+import numpy
+
+from render import SummaryPyramid, decimate
+
+
+def _channel(count, seed=0):
+    y = numpy.random.default_rng(seed).normal(size=count)
+    y[::7] = numpy.nan
+    y[100:400] = numpy.nan
+    return y
+
+
+def test_incremental_update_matches_one_shot():
+    y = _channel(10007)
+    whole = SummaryPyramid()
+    whole.update(y)
+    parts = SummaryPyramid()
+    stop = 0
+    for size in numpy.random.default_rng(1).integers(1, 700, size=100):
+        stop = min(stop + int(size), len(y))
+        parts.update(y[:stop])
+    parts.update(y)
+    a = whole.to_arrays()
+    b = parts.to_arrays()
+    for name in ("sizes", "min", "max", "sum", "count"):
+        assert numpy.array_equal(a[name], b[name], equal_nan=True), name
+
+
+def test_means_of_a_range():
+    y = _channel(4096)
+    pyramid = SummaryPyramid()
+    pyramid.update(y)
+    means = pyramid.means(3, 30, 40)
+    expected = [numpy.nanmean(y[j * 16:(j + 1) * 16]) for j in range(30, 40)]
+    assert numpy.allclose(means, expected)
+
+
+def test_decimate_keeps_peaks():
+    t = numpy.arange(100000, dtype=numpy.float64)
+    y = numpy.zeros(len(t))
+    y[54321] = 10.0
+    y[12345] = -10.0
+    pyramid = SummaryPyramid()
+    pyramid.update(y)
+    x, values = decimate(t, y, pyramid, 0, len(t), 500)
+    assert len(x) <= 4 * 500 + 10
+    assert values.max() == 10.0 and values.min() == -10.0
+    x, values = decimate(t, y, pyramid, 0, len(t), 500, mean=True)
+    assert len(x) < 1000 and values.max() < 10.0
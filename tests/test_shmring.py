@@ -0,0 +1,64 @@
+import secrets
+
+import numpy
+import pytest
+
+from shmring import _GENERATION, _WRITING, ShmRingReader, ShmRingWriter
+
+CAPACITY = 16
+
+
+@pytest.fixture
+def writer():
+    ring = ShmRingWriter(f"cansat_test_{secrets.token_hex(4)}", capacity=CAPACITY, channels=2)
+    yield ring
+    ring.close()
+
+
+def _samples(start, count):
+    timestamps = numpy.arange(start, start + count, dtype=numpy.float64)
+    return timestamps, numpy.column_stack((timestamps * 10, timestamps * 100))
+
+
+def test_reads_new_samples(writer):
+    reader = ShmRingReader(writer.block.name)
+    writer.write(*_samples(0, 5))
+    timestamps, values, lost = reader.read()
+    assert timestamps.tolist() == [0, 1, 2, 3, 4]
+    assert values[:, 1].tolist() == [0, 100, 200, 300, 400]
+    assert lost == 0
+    assert len(reader.read()[0]) == 0
+    reader.close()
+
+
+def test_overrun_is_counted_as_lost(writer):
+    reader = ShmRingReader(writer.block.name)
+    writer.write(*_samples(0, 10))
+    writer.write(*_samples(10, 30))
+    timestamps, _, lost = reader.read()
+    assert lost == 24
+    assert timestamps.tolist() == list(range(24, 40))
+    assert reader.lost == 24
+    reader.close()
+
+
+def test_write_in_progress_drops_samples_being_overwritten(writer):
+    reader = ShmRingReader(writer.block.name)
+    writer.write(*_samples(0, 10))
+    # Writer has said it will write 12 more samples but hasn't changed sequence number yet
+    # They overwrite the 6 oldest samples of the ring, so those can't be trusted
+    writer.header[_WRITING] = 22
+    timestamps, _, lost = reader.read()
+    assert timestamps.tolist() == [6, 7, 8, 9]
+    assert lost == 6
+    reader.close()
+
+
+def test_replaced_when_writer_closes(writer):
+    reader = ShmRingReader(writer.block.name, from_start=True)
+    assert not reader.replaced()
+    writer.write(*_samples(0, 3))
+    assert reader.read()[0].tolist() == [0, 1, 2]
+    writer.header[_GENERATION] = 0
+    assert reader.closed() and reader.replaced()
+    reader.close()